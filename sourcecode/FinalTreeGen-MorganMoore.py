@@ -27,16 +27,532 @@
     The objects have then been set their materials and two tuples (both of two strings) which contain the new shading group name, and the new shader name are returned to the caller
     
     Additional elements of the program include the save undo and cancel tools:
-    The undo tool loads the maya file from the previous tree generation
+    The undo tool rebuilds the previous tree from its parameters and seed, and the redo tool rebuilds the tree that was undone
     the save tool creates a window where the user can specify how to save their tree and then save it
     the ‘cancel’ tool calls a the cancelCallback function which closes the main window
 
   '''  
-import maya.cmds as cmds
+try:
+    import maya.cmds as cmds
+except ImportError:
+    #outside Maya the scene commands go to a RecordingCmds stand-in, set up below
+    cmds = None
+try:
+    import maya.mel as mel
+except ImportError:
+    mel = None
+try:
+    import maya.api.OpenMaya as om
+except ImportError:
+    om = None
 import math as math
 import functools
 import ast as ast
 import random as rand
+import collections
+import json
+import shutil
+import struct
+import tempfile
+import time
+import os
+import multiprocessing
+import itertools
+import contextlib
+import argparse
+import sys
+import importlib.machinery
+import numpy as np
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import fcntl
+except ImportError:
+    #without file locks, on Windows, processes sharing the geometry cache rely on its atomic renames alone
+    fcntl = None
+import hashlib
+
+#number of expanded l-system generations kept in the expansion cache
+EXPANSION_CACHE_SIZE = 16
+
+#LRU cache of expanded strings keyed by (axiom, rules, iterations), most recently used last
+expansionCache = collections.OrderedDict()
+
+#above this many iterations treegen streams the symbols with iterateLazy rather than expanding the full string
+STREAMING_ITERATIONS = 5
+
+#the largest number of branch segments, after collapsing, plus expected leaves and apples treegen will build for a single tree,
+#every preset fits at 8 iterations and the smaller ones at 9
+NODE_BUDGET = 250000
+
+#when True a tree over NODE_BUDGET is built with fewer iterations, when False it is refused
+AUTO_REDUCE_ITERATIONS = True
+
+#how the branches are built, 'merged' for one mesh per tree, 'level' for one mesh per branch level or 'cylinders' for one polyCylinder per segment
+BRANCH_MESH = 'merged'
+
+#the number of sides of each branch cylinder, the same as the polyCylinder default
+BRANCH_SUBDIVISIONS = 20
+
+#when True runs of F and J with nothing between them are built as one long segment instead of many short ones
+COLLAPSE_SEGMENTS = True
+
+#how leaves and apples are placed, 'instanced' for one particle instancer sharing the template mesh or 'duplicate' for one copy per placement
+LEAF_MODE = 'instanced'
+
+#the number of segments the turtle hands over at a time when the tree is streamed, e.g. to an exporter
+TURTLE_CHUNK_SIZE = 4096
+
+#the last tree treegen built: its 'params', 'axiom', 'rules', 'iterations', interpreted 'turtle', scene 'groups'
+#and the 'lodMembers' returned by buildLods, or None without levels of detail,
+#used to redo only the stages a change of parameters affects and to export it directly
+lastBuild = {}
+
+#the parameters each build stage depends on, a change to any of them means the stage has to be redone
+BUILD_STAGES = (('geometry', ('treetype', 'treetype2', 'iterations', 'length', 'angle', 'thicker')),
+                ('leaves', ('leaf', 'leaftype', 'leafscale', 'seed')),
+                ('apples', ('apple', 'seed')),
+                ('materials', ('material', 'leafmaterial', 'rgb', 'leavesrgb')),
+                ('lods', ('lods',)))
+
+#the undo and redo history, records of {'params', 'turtle'} oldest first, regenerated from the parameters and seed
+undoStack = []
+redoStack = []
+
+#the number of undo steps kept
+UNDO_LIMIT = 50
+
+#the number of newest undo records that also keep their interpreted turtle arrays, so undoing them skips expansion
+UNDO_SNAPSHOTS = 3
+
+#the independent random streams of every tree, see randomStreams; 'branchHeight' is kept for the per-segment height
+#jitter rh the original loop drew but never used, so adding it later will not change any other random value
+RANDOM_STREAMS = ('leafScale', 'leafAccept', 'leafRotation', 'appleAccept', 'branchHeight')
+
+#the edge length of the spatial hash grid cells leaves are binned into, about the size of a leaf
+LEAF_CELL_SIZE = 0.25
+
+#the most leaves kept in one grid cell, overlapping leaves past it are dropped, 0 keeps every leaf;
+#culling is off by default as it thins every tree, not only Thicker ones, 3 suits dense Thicker trees
+LEAF_CELL_LIMIT = 0
+
+#the levels of detail built from one tree, LOD0 first, each as (deepest branch level kept or None for every level,
+#cylinder subdivisions, fraction of the leaves kept, billboard cell size or None), with a billboard cell size
+#the leaves are replaced by one crossed card per grid cell of that size
+LOD_SETTINGS = ((None, BRANCH_SUBDIVISIONS, 1.0, None),
+                (8, 10, 0.5, None),
+                (5, 6, 0.25, None),
+                (3, 4, 1.0, 1.5))
+
+#when True Apply builds the tree a slice at a time from Maya's idle event, keeping the interface responsive while it grows
+SLICED_BUILD = False
+
+#the milliseconds of work each idle tick of a sliced build is given
+SLICE_TIME = 30
+
+#the number of branch segments the turtle turns out at a time in a sliced build, each is committed to the scene as one mesh
+SLICE_CHUNK_SIZE = 512
+
+#the distinct looks built of each tree of a forest, each is the same branches with its own leaves and apples, see buildForest
+FOREST_VARIANTS = 3
+
+#the independent random streams of a forest, see randomStreams
+FOREST_STREAMS = ('forestPlace', 'forestTree', 'forestVariant', 'forestScale', 'forestRotation')
+
+#the smallest and largest uniform scale of a placed tree of a forest
+FOREST_SCALE = (0.8, 1.25)
+
+#the most a placed tree of a forest leans away from upright, in degrees
+FOREST_TILT = 4.0
+
+#the colour of the apples of a forest, which are built from APPLE_MESH rather than the apple template scene
+FOREST_APPLE_COLOUR = (0.8, 0.1, 0.1)
+
+#the version of the geometry the generator makes, part of every geometry cache key,
+#raise it whenever a change makes the same parameters give a different tree so old cache entries are never used
+GENERATOR_VERSION = 1
+
+#when True interpreted trees are kept in the geometry cache on disk and loaded from it instead of being expanded again
+GEOMETRY_CACHE = True
+
+#the directory of the geometry cache, shared by every session and batch worker process
+GEOMETRY_CACHE_DIR = os.environ.get('TREEGEN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.treegen', 'geometry'))
+
+#the most bytes the geometry cache holds, the least recently used trees are evicted past it
+GEOMETRY_CACHE_SIZE = 1 << 30
+
+#the sliced build in progress, None when there is none
+slicedBuild = None
+
+#the opcodes the turtle runs, compiled from the drawing symbols of the action string, F and J both step forward
+OP_STEP, OP_LEAF, OP_APPLE, OP_LEFT, OP_RIGHT, OP_DOWN, OP_UP, OP_PUSH, OP_POP = range(9)
+#not compiled from any symbol, used by runOpcodes to restore the turtle state carried over from the block before
+OP_STATE = 9
+TURTLE_OPCODES = {'F': OP_STEP, 'J': OP_STEP, 'l': OP_LEAF, 'a': OP_APPLE, '-': OP_LEFT, '+': OP_RIGHT,
+                  '/': OP_DOWN, '|': OP_UP, '[': OP_PUSH, ']': OP_POP}
+OPCODE_COUNT = 9
+
+#translates the drawing symbols to their opcodes, any other symbol is left as it is and dropped as it is not below OPCODE_COUNT
+OPCODE_TABLE = str.maketrans(dict((symbol, chr(op)) for symbol, op in TURTLE_OPCODES.items()))
+
+#the number of symbols of an action string compiled and run by the turtle at a time
+OPCODE_BLOCK = 16384
+
+#the maximum value of the progress bar in the user interface
+PROGRESS_MAX = 8000
+
+#the share of the progress bar given to the turtle, the scene building and materials fill the rest
+PROGRESS_TURTLE_SHARE = 0.6
+
+#the shortest time in milliseconds between two progress bar updates
+PROGRESS_INTERVAL = 100
+
+#set by the Stop button, checked by the progress reporter of the running build
+cancelRequested = False
+
+#when True every build is timed phase by phase and a report printed to the Script Editor
+PROFILE_BUILDS = False
+
+#when True profiled builds also follow the Python heap peak with tracemalloc, which slows every phase several times over,
+#so the phase times of a build profiled with it are not to be compared with those of one profiled without it
+PROFILE_MEMORY = False
+
+#when set, the JSON file every build report is appended to, to follow regressions across presets and iterations
+PROFILE_REPORT_PATH = None
+
+#the profiler of the build in progress, None when the build is not being profiled
+activeProfiler = None
+
+#the directory holding the leaf and apple template scenes and the interface image, set with the TREEGEN_ASSET_ROOT environment variable
+ASSET_ROOT = os.environ.get('TREEGEN_ASSET_ROOT', '/home/s5113911/PythonProgramming/Project')
+
+#the leaf templates of the leaves control: the scene file under ASSET_ROOT, the template object in it, and the namespace it is loaded into
+LEAF_ASSETS = {1: ('leafynomaterial.ma', 'leafy2', 'treeLeafAsset'),
+               2: ('mapleleaf2.ma', 'leafy2', 'treeMapleAsset')}
+
+#the apple template: the scene file under ASSET_ROOT, the template object in it, and the namespace it is loaded into
+APPLE_ASSET = ('apple.ma', 'apple1', 'treeAppleAsset')
+
+#the hidden group the loaded templates are kept in, it is left alone when the scene is cleared for a new tree
+ASSET_GROUP = 'treeAssets'
+
+#the loaded templates, namespace: (path, modification time of the file when it was loaded)
+assetCache = {}
+
+#the shading groups and shaders made by setMaterial, (material type, R, G, B): (shading group, shader)
+shaderPool = {}
+
+#the number of decimals colours are rounded to before looking them up in the shader pool
+SHADER_COLOUR_DIGITS = 3
+
+#when True the pooled shaders no tree uses any more are deleted after every material assignment
+DELETE_UNUSED_SHADERS = True
+
+#the tree types of the user interface by name, with the values of the treetype and treetype2 controls that select them
+TREE_PRESETS = collections.OrderedDict([('Standard', (1, 0)), ('Dispersed', (2, 0)), ('Curved', (3, 0)), ('Slant', (4, 0)),
+										('Square', (0, 1)), ('Curved2', (0, 2))])
+
+#the card standing in for a cluster of leaves in the lowest levels of detail, two crossed unit quads centred on the origin: points, face counts, face indices
+BILLBOARD_CARD = (np.array([[-0.5, -0.5, 0.0], [0.5, -0.5, 0.0], [0.5, 0.5, 0.0], [-0.5, 0.5, 0.0],
+                            [0.0, -0.5, -0.5], [0.0, -0.5, 0.5], [0.0, 0.5, 0.5], [0.0, 0.5, -0.5]]),
+                  np.array([4, 4]), np.arange(8))
+
+#the leaf used by the exporters in place of the leaf template scene, a diamond card growing up from its stalk: points, face counts, face indices
+LEAF_CARD = (np.array([[0.0, 0.0, 0.0], [0.15, 0.25, 0.0], [0.0, 0.6, 0.0], [-0.15, 0.25, 0.0]]), np.array([4]), np.array([0, 1, 2, 3]))
+
+#the apple used by the exporters in place of the apple template scene, an octahedron of radius 1 before the 0.1 apple scale
+APPLE_MESH = (np.array([[1.0, 0.0, 0.0], [-1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, -1.0, 0.0], [0.0, 0.0, 1.0], [0.0, 0.0, -1.0]]),
+			  np.full(8, 3),
+			  np.array([0, 2, 4, 4, 2, 1, 1, 2, 5, 5, 2, 0, 4, 3, 0, 1, 3, 4, 5, 3, 1, 0, 3, 5]))
+
+
+class RecordingCmds(object):
+	''' a stand-in for maya.cmds that records every command instead of running it,
+	so trees can be built, profiled and tested headless outside Maya
+
+	Creation commands return new unique node names, queries return None.
+	The recorded commands are kept in calls as (command name, args, kwargs) tuples.
+	'''
+	
+	#commands that return a list of node names in Maya rather than a single name
+	LIST_COMMANDS = ('polyCylinder', 'polyCube', 'polyPlane', 'polySphere', 'duplicate', 'instance', 'particle', 'ls')
+	
+	def __init__(self):
+		self.calls = []
+		self.nameCounter = collections.Counter()
+	
+	def __getattr__(self, name):
+		if name.startswith('__'):
+			raise AttributeError(name)
+		return functools.partial(self.record, name)
+	
+	def record(self, command, *args, **kwargs):
+		''' record a command and return a plausible result for it
+
+		command		: the name of the maya.cmds command
+		args		: the positional arguments of the command
+		kwargs		: the flags of the command
+		return		: a unique node name, a list of them for LIST_COMMANDS, or None for queries
+		'''
+		self.calls.append((command, args, kwargs))
+		if kwargs.get('query') or kwargs.get('q') or kwargs.get('edit') or kwargs.get('e') or kwargs.get('exists') or kwargs.get('ex'):
+			return None
+		self.nameCounter[command] += 1
+		name = kwargs.get('name', kwargs.get('n', command)) + str(self.nameCounter[command])
+		if command in self.LIST_COMMANDS:
+			return [name, name + 'Shape']
+		return name
+	
+	def count(self, command=None):
+		''' the number of recorded commands
+
+		command		: only count this command when given
+		return		: the number of matching recorded commands
+		'''
+		if command is None:
+			return len(self.calls)
+		return sum(1 for call in self.calls if call[0] == command)
+
+def setCommandBackend(backend):
+	''' swap the object that scene commands are sent to, e.g. a RecordingCmds for headless runs
+
+	backend		: maya.cmds or a RecordingCmds
+	return		: the backend that was in use before
+	'''
+	global cmds
+	previousBackend = cmds
+	cmds = backend
+	return previousBackend
+
+def isHeadless():
+	''' whether scene commands are being recorded rather than run in Maya
+
+	return		: True when cmds is a RecordingCmds, directly or behind a CountingCmds
+	'''
+	return isinstance(cmds, RecordingCmds) or isinstance(getattr(cmds, 'backend', None), RecordingCmds)
+
+if cmds is None:
+	cmds = RecordingCmds()
+
+
+class BuildCancelled(Exception):
+	''' raised inside a build when the user cancels it '''
+
+class ProgressReporter(object):
+	''' reports how far the turtle has got through a tree to the progress bar, and lets the user cancel the build
+
+	The turtle calls it with the index of the symbol it has reached, and it only touches the user interface when at least
+	PROGRESS_INTERVAL milliseconds have passed, so the cost per symbol stays negligible however big the tree is.
+	The total comes from the predicted length of the action string. On each update it looks for the Esc key through
+	Maya's main progress bar and for the Stop button, and raises BuildCancelled when either asked to stop.
+	'''
+	
+	def __init__(self, control, total):
+		'''
+		control		: the path name to the progress bar control to allow for editing
+		total		: the number of symbols the turtle will process
+		'''
+		global cancelRequested
+		cancelRequested = False
+		self.control = control
+		self.total = float(max(total, 1))
+		self.interval = PROGRESS_INTERVAL / 1000.0
+		self.lastUpdate = time.time()
+		cmds.progressBar(control, edit=True, pr=0)
+		self.mainBar = None
+		if mel is not None and not isHeadless():
+			self.mainBar = mel.eval('$tmp = $gMainProgressBar')
+			cmds.progressBar(self.mainBar, edit=True, beginProgress=True, isInterruptable=True, status='Building tree, Esc to cancel', maxValue=100)
+	
+	def __call__(self, done):
+		''' report that the turtle has reached symbol number done
+
+		done		: the index of the symbol reached
+		'''
+		now = time.time()
+		if now - self.lastUpdate < self.interval:
+			return
+		self.lastUpdate = now
+		fraction = min(done / self.total, 1.0)
+		cmds.progressBar(self.control, edit=True, pr=int(PROGRESS_MAX * PROGRESS_TURTLE_SHARE * fraction))
+		if self.mainBar is not None:
+			cmds.progressBar(self.mainBar, edit=True, progress=int(100 * fraction))
+		self.checkCancelled()
+	
+	def phase(self, fraction):
+		''' move the progress bar to a fixed point once the turtle has finished
+
+		fraction	: how far through the whole build, between 0 and 1
+		'''
+		cmds.progressBar(self.control, edit=True, pr=int(PROGRESS_MAX * fraction))
+	
+	def checkCancelled(self):
+		''' raise BuildCancelled when the user has pressed Esc or the Stop button '''
+		if cancelRequested or (self.mainBar is not None and cmds.progressBar(self.mainBar, query=True, isCancelled=True)):
+			raise BuildCancelled()
+	
+	def finish(self):
+		''' give Maya's main progress bar back '''
+		if self.mainBar is not None:
+			cmds.progressBar(self.mainBar, edit=True, endProgress=True)
+			self.mainBar = None
+
+def cancelBuild(*pArgs):
+	''' ask the running build to stop, it stops cleanly at its next progress update, or at the next slice of a sliced build '''
+	global cancelRequested
+	cancelRequested = True
+
+
+class CountingCmds(object):
+	''' passes every scene command on to another backend, counting them against the current phase of a BuildProfiler '''
+	
+	def __init__(self, backend, profiler):
+		'''
+		backend		: maya.cmds or a RecordingCmds that runs the commands
+		profiler	: the BuildProfiler the commands are counted for
+		'''
+		self.backend = backend
+		self.profiler = profiler
+	
+	def __getattr__(self, name):
+		if name.startswith('__'):
+			raise AttributeError(name)
+		return functools.partial(self.run, getattr(self.backend, name))
+	
+	def run(self, command, *args, **kwargs):
+		self.profiler.commands[self.profiler.current] += 1
+		return command(*args, **kwargs)
+
+class BuildProfiler(object):
+	''' times each phase of a build and counts the scene commands it issues
+
+	While it runs, scene commands go through a CountingCmds so every command is counted against the phase
+	it was issued in. The peak size of the whole process, Maya included, is read with resource where the platform has it,
+	and with PROFILE_MEMORY on the Python heap peak is followed with tracemalloc. Tracing slows every allocation,
+	so it is off by default and the memory is best profiled in a separate build from the times.
+	The sizes of the tree are added with record.
+	'''
+	
+	def __init__(self, params):
+		'''
+		params		: the build parameters, kept in the report so reports of different trees can be told apart
+		'''
+		self.params = params
+		self.phases = collections.OrderedDict()
+		self.commands = collections.Counter()
+		self.counts = collections.OrderedDict()
+		self.current = 'other'
+		self.previousBackend = None
+		self.started = 0.0
+		self.total = 0.0
+	
+	def start(self):
+		''' start counting commands, and following the Python heap when PROFILE_MEMORY is on '''
+		global activeProfiler
+		activeProfiler = self
+		self.previousBackend = setCommandBackend(CountingCmds(cmds, self))
+		if PROFILE_MEMORY and tracemalloc is not None:
+			tracemalloc.start()
+		self.started = time.time()
+	
+	def stop(self):
+		''' stop profiling and put the scene commands back as they were '''
+		global activeProfiler
+		self.total = time.time() - self.started
+		if tracemalloc is not None and tracemalloc.is_tracing():
+			self.counts['pythonPeakBytes'] = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+		if resource is not None:
+			#ru_maxrss is in kilobytes on Linux and bytes on macOS
+			scale = 1 if os.uname()[0] == 'Darwin' else 1024
+			self.counts['processPeakBytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+		setCommandBackend(self.previousBackend)
+		activeProfiler = None
+	
+	@contextlib.contextmanager
+	def phase(self, name):
+		''' time the body of a with statement as the named phase, the time is added to any earlier time of that phase
+
+		name		: the name of the phase
+		'''
+		outer = self.current
+		self.current = name
+		started = time.time()
+		try:
+			yield
+		finally:
+			self.phases[name] = self.phases.get(name, 0.0) + time.time() - started
+			self.current = outer
+	
+	def record(self, name, value):
+		''' record a size of the tree, e.g. the number of leaves
+
+		name		: the name of the size
+		value		: the size
+		'''
+		self.counts[name] = value
+	
+	def report(self):
+		''' the report of the build
+
+		return		: a dictionary of the parameters, the time and command count of each phase and the sizes of the tree
+		'''
+		return {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+		        'params': dict(self.params),
+		        'total': self.total,
+		        'phases': collections.OrderedDict((name, {'seconds': seconds, 'commands': self.commands[name]}) for name, seconds in self.phases.items()),
+		        'commands': sum(self.commands.values()),
+		        'counts': self.counts}
+	
+	def printReport(self):
+		''' print the report to the Script Editor '''
+		report = self.report()
+		print("Tree build took %.3fs and %d commands" % (report['total'], report['commands']))
+		for name, phase in report['phases'].items():
+			print("  %-16s %8.3fs %8d commands" % (name, phase['seconds'], phase['commands']))
+		for name, value in report['counts'].items():
+			print("  %-16s %d" % (name, value))
+
+@contextlib.contextmanager
+def profilePhase(name):
+	''' time the body of a with statement as a phase of the build being profiled, does nothing when it is not
+
+	name		: the name of the phase
+	'''
+	if activeProfiler is None:
+		yield
+	else:
+		with activeProfiler.phase(name):
+			yield
+
+def profileCount(name, value):
+	''' record a size of the tree being profiled, does nothing when it is not
+
+	name		: the name of the size
+	value		: the size
+	'''
+	if activeProfiler is not None:
+		activeProfiler.record(name, value)
+
+def writeProfile(report, path):
+	''' append a build report to a JSON file holding a list of reports
+
+	report		: the dictionary returned by BuildProfiler.report
+	path		: the path of the JSON file, it is created if it does not exist
+	'''
+	reports = []
+	if os.path.exists(path):
+		with open(path) as reportFile:
+			reports = json.load(reportFile)
+	reports.append(report)
+	with open(path, 'w') as reportFile:
+		json.dump(reports, reportFile, indent=1)
 
 
 def cancelCallback(windowID,*pArgs):
@@ -80,8 +596,7 @@ def createUI( windowname, pApplyCallback):
     cmds.columnLayout( adjustableColumn=True )
     
     #the user interface image that will appear at the top of the window
-    submission_path = "/home/s5113911/PythonProgramming"
-    cmds.image( w =10, h = 150, i= submission_path+"/Project/panarama4.jpg")
+    cmds.image( w =10, h = 150, i= os.path.join(ASSET_ROOT, "panarama4.jpg"))
     cmds.separator(h =10, style = 'none')
        
     cmds.text( label ='Tree Type:',align='left')
@@ -111,7 +626,7 @@ def createUI( windowname, pApplyCallback):
     #slider controls to specify the length, angle and iterations of the tree, (iterations meaning th number of the types the chosen l-system will be iterated
     length = cmds.floatSliderGrp(label='Height:', minValue=0.05, maxValue=1.0, value=0.6, step=0.01, field=True, columnAlign=[1,'left'])
     angle = cmds.floatSliderGrp(label='Angle:', minValue=10, maxValue=60, value=25, step=0.01, field=True, columnAlign=[1,'left'])
-    iterations = cmds.intSliderGrp( label='Iterations:', minValue=1, maxValue=5, value=4, step=1, field = True, columnAlign=[1,'left'] )
+    iterations = cmds.intSliderGrp( label='Iterations:', minValue=1, maxValue=9, value=4, step=1, field = True, columnAlign=[1,'left'] )
     
     cmds.separator(h =10, style = 'none')
     
@@ -147,25 +662,44 @@ def createUI( windowname, pApplyCallback):
     #control to specify the 'thickness' of the leaves, e.g if thicker is selected the rule l = ll is added which on average will double the number of leaves created
     leavesamount =cmds.radioButtonGrp( label='', labelArray2=['Default', 'Thicker'], numberOfRadioButtons=2, select = 1)
      
+    cmds.separator(h =10, style = 'none')
+    
+    #control to set the seed of the random leaf and apple placement, the same seed and settings always give the same tree
+    seed = cmds.intFieldGrp( label='Seed:', value1=rand.randrange(100000), columnAlign=[1,'left'] )
+    cmds.button( label='New Seed', command=functools.partial(newSeed, seed) )
+    
+    cmds.separator(h =10, style = 'none')
+    
+    #control to also build lower levels of detail of the tree, from the same turtle pass
+    lods = cmds.checkBoxGrp( numberOfCheckBoxes=1, label='LODs?:  ', columnAlign=[1,'left'] )
+     
     cmds.separator(h =10, style = 'none')
     cmds.separator(h =10, style = 'none')
     
     #creating and defining the flags of the progress bar, which will allow the user to track the programs progress for each tree generation
-    progressControl = cmds.progressBar(maxValue=8000, width = 300, bgc =[0.23,0.16,0.0] )
+    progressControl = cmds.progressBar(maxValue=PROGRESS_MAX, width = 300, bgc =[0.23,0.16,0.0] )
     
     cmds.separator(h =10, style = 'none')
     
     #when the apply button is pressed, the path names of the various controls are passed to the pApplyCallback function( treegen function)
-    cmds.button( label='Apply', backgroundColor=[0.9,0.9,0.9], command=functools.partial( pApplyCallback, length, iterations, treetype, materiall, rgbs, leafscale, leavesamount, rgbleaves, applecheck, leafcheck, angle, leaves, treetype2, progressControl, materialleaves) )
+    cmds.button( label='Apply', backgroundColor=[0.9,0.9,0.9], command=functools.partial( pApplyCallback, length, iterations, treetype, materiall, rgbs, leafscale, leavesamount, rgbleaves, applecheck, leafcheck, angle, leaves, treetype2, progressControl, materialleaves, seed, lods) )
              
     cmds.separator(h =10, style = 'none')
     
+    #the 'cancelBuild' function is called, stopping the build in progress
+    cmds.button( label = 'Stop Build', command=functools.partial(cancelBuild), backgroundColor=[0.5,0.1,0.05])
+    cmds.separator(h =10, style = 'none')
+    
     #the 'savemenu' fucntion is called
     cmds.button( label = 'Save', command=functools.partial(savemenu), backgroundColor=[0.101,0.338,0.017])
     cmds.separator(h =10, style = 'none') 
     
     #The 'previous' function is called
-    cmds.button( label = 'Undo', command=functools.partial(previous), backgroundColor=[0.23,0.16,0.0])
+    cmds.button( label = 'Undo', command=functools.partial(previous, progressControl), backgroundColor=[0.23,0.16,0.0])
+    cmds.separator(h =10, style = 'none')
+    
+    #The 'redo' function is called
+    cmds.button( label = 'Redo', command=functools.partial(redo, progressControl), backgroundColor=[0.23,0.16,0.0])
     cmds.separator(h =10, style = 'none')
     
     cmds.separator(h =10, style = 'none')
@@ -180,6 +714,13 @@ def createUI( windowname, pApplyCallback):
     cmds.showWindow()
     cmds.window(windowID, e=True, width=640)   
     
+def newSeed(seed, *pArgs):
+    '''put a new random seed in the seed control
+    
+       seed		: The path name to the seed control
+    '''
+    cmds.intFieldGrp(seed, edit=True, value1=rand.randrange(100000))
+    
 def savemenu(*pArgs):
     '''creates a window for the user to enter a name and select the format of their generated tree''' 
       
@@ -190,21 +731,40 @@ def savemenu(*pArgs):
     cmds.text( label='Enter Filename: ',align='left')
     filename = cmds.textField( width=1, text='Filename?')
     fileformats = cmds.radioButtonGrp( numberOfRadioButtons=3, label='File Format:  ', labelArray3=['MayaAscii', 'OBJ', 'MayaBinary'], select = 1)
+    #formats written straight from the last tree's parameters, without going through the scene
+    fileformats2 = cmds.radioButtonGrp( numberOfRadioButtons=2, shareCollection=fileformats, label='', labelArray2=['OBJ (direct)', 'GLB (direct)'])
     
     #when the user clicks the save button the path names of the filename and fileformats controls are passed to the 'save' fucntion
-    cmds.button( label='save', backgroundColor=[0.1,0.3,0.2], command=functools.partial( save, fileformats, filename))
+    cmds.button( label='save', backgroundColor=[0.1,0.3,0.2], command=functools.partial( save, fileformats, filename, fileformats2))
     cmds.showWindow() 
        
-def save(pfileformat, pfilename, *pArgs):
+def save(pfileformat, pfilename, pfileformat2, *pArgs):
     '''saves the current file with gthe given format and name
     
        pfileformat	: the user specified file format from savemenu GUI
        pfilename	: the user specified filename from savemenu GUI
+       pfileformat2	: the user specified direct export format from savemenu GUI
     '''
     
     fileformats = []
     filename = cmds.textField(pfilename, query=True, text=True)
     fileformats= cmds.radioButtonGrp(pfileformat, query=True, select=True) 
+    directformat = cmds.radioButtonGrp(pfileformat2, query=True, select=True)
+    
+    if directformat:
+        #export the last tree straight from the turtle it was built from
+        if not lastBuild:
+            print("Saving was unsuccessful!!! Generate a tree first")
+            return
+        extension = ".obj" if directformat == 1 else ".glb"
+        params = lastBuild['params']
+        exporter = exportLods if params.get('lods') else exportTree
+        exporter(os.path.join(ASSET_ROOT, filename + extension), None, params['length'], params['angle'],
+                 params['leafscale'], params['leaf'], params['apple'], {'branches': params['rgb'], 'leaves': params['leavesrgb']}, params['seed'],
+                 turtle=lastBuild['turtle'])
+        print("Saved successfully!!!")
+        cancelCallback('savemenu')
+        return
     
     if fileformats == 1:
         fileformat = "mayaAscii"
@@ -214,15 +774,73 @@ def save(pfileformat, pfilename, *pArgs):
         fileformat = "mayaBinary"
     else:
         print("Saving was unsuccessful!!!")
-    cmds.file(rename="/home/s5113911/PythonProgramming/Project/%s" % filename)
+    cmds.file(rename=os.path.join(ASSET_ROOT, filename))
     saved = cmds.file(save=True, type=fileformat)
     print("Saved successfully!!!")
     cancelCallback('savemenu')
     
-def previous(*pArgs):
-    '''opens the 'previous' file that was saved before the scene was deleted for the current generation, this acts as a simple undo function'''
+def previous(progress, *pArgs):
+    '''rebuilds the tree from before the last Apply from its parameters and seed, this acts as the undo function
     
-    cmds.file( "/home/s5113911/PythonProgramming/Project/previous.ma", o=True )
+       progress	: the path name to the progress bar control to allow for editing
+    '''
+    
+    if not undoStack:
+        print("Nothing to undo")
+        return
+    stopSlicedBuild()
+    record = undoStack.pop()
+    current = snapshotRecord()
+    if current is not None:
+        redoStack.append(current)
+        trimHistory(redoStack)
+    buildTree(record['params'], progress, record['turtle'], remember=False)
+    
+def redo(progress, *pArgs):
+    '''rebuilds the tree that the last undo took away
+    
+       progress	: the path name to the progress bar control to allow for editing
+    '''
+    
+    if not redoStack:
+        print("Nothing to redo")
+        return
+    stopSlicedBuild()
+    record = redoStack.pop()
+    current = snapshotRecord()
+    if current is not None:
+        undoStack.append(current)
+        trimHistory(undoStack)
+    buildTree(record['params'], progress, record['turtle'], remember=False)
+    
+def rememberBuild():
+    '''push the tree in the scene onto the undo stack as it is replaced, remembered by its parameters rather than by saving the scene,
+    the redo history no longer applies after a new tree
+    '''
+    record = snapshotRecord()
+    if record is not None:
+        undoStack.append(record)
+        trimHistory(undoStack)
+        del redoStack[:]
+    
+def snapshotRecord():
+    '''make an undo record of the tree currently in the scene
+    
+       return	: a dictionary holding the 'params' of the last build and its interpreted 'turtle' arrays,
+                  or None when there is no tree, e.g. after a cancelled build
+    '''
+    if not lastBuild:
+        return None
+    return {'params': lastBuild['params'], 'turtle': lastBuild['turtle']}
+    
+def trimHistory(stack):
+    '''keep an undo or redo stack within UNDO_LIMIT records, with only the newest UNDO_SNAPSHOTS keeping their turtle arrays
+    
+       stack	: the list of records, oldest first
+    '''
+    del stack[:-UNDO_LIMIT]
+    for record in stack[:-UNDO_SNAPSHOTS]:
+        record['turtle'] = None
     
 def addRule(ruleDict, replaceStr, newStr ):
 	''' add a new rule to the ruleDict
@@ -233,21 +851,285 @@ def addRule(ruleDict, replaceStr, newStr ):
 	'''
 	ruleDict[ replaceStr ] = newStr
 
+def ruleKey(ruleDict):
+	''' build a hashable, order independent key from a rule dictionary
+
+	ruleDict		: the dictionary holding the rules
+	return			: a sorted tuple of (symbol, replacement) pairs
+	'''
+	return tuple(sorted(ruleDict.items()))
+
+def cacheExpansion(key, expanded):
+	''' store an expanded string in the LRU expansion cache, evicting the least recently used entries
+
+	key				: the (axiom, rule key, iterations) tuple identifying the expansion
+	expanded		: the expanded string
+	'''
+	expansionCache[key] = expanded
+	expansionCache.move_to_end(key)
+	while len(expansionCache) > EXPANSION_CACHE_SIZE:
+		expansionCache.popitem(last=False)
+
 def iterate(baseString, numIterations, ruleDict):
 	''' following the rules, replace old characters with new ones
 
+	Each generation is rewritten in a single pass with str.translate, so the cost is linear in the length of the string.
+	Every generation is kept in an LRU cache keyed by (axiom, rules, iterations); when generation n-1 of the same
+	axiom and rules is cached, generation n costs a single rewrite instead of starting again from the axiom.
+
 	baseString		: start string
 	numIterations	: how many times the rules will be used
 	ruleDict		: the dictionary holding the rules
 	return			: return the final expanded string
 	'''
+	rules = ruleKey(ruleDict)
+	
+	#start from the furthest generation of this axiom and rule set that has already been expanded
+	generation = 0
+	expanded = baseString
+	for n in range(numIterations, 0, -1):
+		key = (baseString, rules, n)
+		if key in expansionCache:
+			expansionCache.move_to_end(key)
+			generation = n
+			expanded = expansionCache[key]
+			break
+	
+	#only single characters are ever matched against the rules, so only those go into the translation table
+	table = str.maketrans({k: v for k, v in ruleDict.items() if len(k) == 1})
+	while generation < numIterations:
+		expanded = expanded.translate(table)
+		generation += 1
+		cacheExpansion((baseString, rules, generation), expanded)
+	return expanded
+	
+def iterateLazy(baseString, numIterations, ruleDict):
+	''' following the rules, yield the symbols of the final expanded string one at a time without ever building it
+
+	The rule tree is walked depth-first with one iterator per generation, so memory use is O(numIterations)
+	rather than the length of the expanded string. The symbols come out in exactly the same order as iterate() produces them.
+
+	baseString		: start string
+	numIterations	: how many times the rules will be used
+	ruleDict		: the dictionary holding the rules
+	return			: a generator over the symbols of the final expanded string
+	'''
+	stack = [(iter(baseString), 0)]
+	while stack:
+		symbols, depth = stack[-1]
+		for symbol in symbols:
+			if depth < numIterations and symbol in ruleDict:
+				#descend into the replacement, this iterator resumes after the replacement has been walked
+				stack.append((iter(ruleDict[symbol]), depth + 1))
+				break
+			yield symbol
+		else:
+			stack.pop()
+	
+def polyAdd(a, b):
+	''' add two polynomials held as lists of integer coefficients, index i holding the coefficient of z**i
+
+	a, b			: the polynomials to add
+	return			: the sum of a and b
+	'''
+	if len(a) < len(b):
+		a, b = b, a
+	total = list(a)
+	for i, coefficient in enumerate(b):
+		total[i] += coefficient
+	return total
+
+def polyMultiply(a, b):
+	''' multiply two polynomials held as lists of integer coefficients
+
+	a, b			: the polynomials to multiply
+	return			: the product of a and b
+	'''
+	if not a or not b:
+		return []
+	product = [0] * (len(a) + len(b) - 1)
+	for i, x in enumerate(a):
+		if x:
+			for j, y in enumerate(b):
+				product[i + j] += x * y
+	return product
+
+def matrixMultiply(a, b, size):
+	''' multiply two square matrices of polynomials
+
+	a, b			: the matrices, lists of rows of polynomials
+	size			: the number of rows and columns
+	return			: the matrix product a*b
+	'''
+	product = [[[] for j in range(size)] for i in range(size)]
+	for i in range(size):
+		for k in range(size):
+			if a[i][k]:
+				for j in range(size):
+					if b[k][j]:
+						product[i][j] = polyAdd(product[i][j], polyMultiply(a[i][k], b[k][j]))
+	return product
+
+def productionMatrix(ruleDict, alphabet):
+	''' build the production matrix of the rules, entry [i][j] is a polynomial in z where the coefficient of z**d
+	counts how many times symbol j appears inside d unclosed brackets in the replacement of symbol i
+
+	ruleDict		: the dictionary holding the rules
+	alphabet		: the list of every symbol that can appear in the expansion
+	return			: the production matrix
+	'''
+	index = {symbol: i for i, symbol in enumerate(alphabet)}
+	size = len(alphabet)
+	matrix = [[[] for j in range(size)] for i in range(size)]
+	for symbol in alphabet:
+		row = matrix[index[symbol]]
+		if symbol not in ruleDict:
+			#symbols without a rule are copied unchanged into the next generation
+			row[index[symbol]] = [1]
+			continue
+		depth = 0
+		for s in ruleDict[symbol]:
+			term = row[index[s]]
+			row[index[s]] = polyAdd(term, [0] * depth + [1])
+			if s == '[':
+				depth += 1
+			elif s == ']':
+				depth -= 1
+	return matrix
+
+def predictTree(baseString, numIterations, ruleDict):
+	''' predict the size of the tree without expanding the l-system, by raising the production matrix to the power of numIterations
+
+	Because brackets in a replacement enclose everything that replacement grows into, the depth of a symbol in the
+	final string is the sum of the bracket depths along its derivation, so tracking depth as the power of z gives exact per level counts.
+	Leaves are kept by scatterLeaves when int(uniform(0, level)) is not 0, which happens with probability 1 - 1/level,
+	and apples when it is 0, with probability 1/level, giving the expected number of leaves and apples.
+
+	baseString		: start string
+	numIterations	: how many times the rules will be used
+	ruleDict		: the dictionary holding the rules
+	return			: a dictionary with the final string length, the exact 'counts' of the F, J, l, a and [ symbols,
+					  the number of 'cylinders', the number of 'segments' after collapsing, the 'expectedLeaves', the 'expectedApples' and the 'maxDepth' of the brackets
+	'''
+	alphabet = sorted(set(baseString).union(ruleDict, *ruleDict.values()))
+	size = len(alphabet)
+	
+	#the axiom as a row vector of polynomials
+	vector = [[] for i in range(size)]
+	depth = 0
+	for s in baseString:
+		i = alphabet.index(s)
+		vector[i] = polyAdd(vector[i], [0] * depth + [1])
+		if s == '[':
+			depth += 1
+		elif s == ']':
+			depth -= 1
+	
+	#raise the production matrix to the number of iterations by repeated squaring
+	power = productionMatrix(ruleDict, alphabet)
+	result = None
+	n = numIterations
+	while n > 0:
+		if n & 1:
+			result = power if result is None else matrixMultiply(result, power, size)
+		n >>= 1
+		if n:
+			power = matrixMultiply(power, power, size)
+	if result is not None:
+		final = [[] for j in range(size)]
+		for i in range(size):
+			if vector[i]:
+				for j in range(size):
+					if result[i][j]:
+						final[j] = polyAdd(final[j], polyMultiply(vector[i], result[i][j]))
+		vector = final
+
+	perLevel = dict(zip(alphabet, vector))
+	counts = {s: sum(perLevel.get(s, [])) for s in 'FJla['}
+	return {'length': sum(sum(p) for p in vector),
+			'counts': counts,
+			'cylinders': counts['F'] + counts['J'],
+			'segments': predictSegments(baseString, numIterations, ruleDict),
+			'expectedLeaves': sum(c * (1.0 - 1.0 / (d + 1)) for d, c in enumerate(perLevel.get('l', []))),
+			'expectedApples': sum(c / (d + 1.0) for d, c in enumerate(perLevel.get('a', []))),
+			'maxDepth': max(len(p) for p in vector) - 1}
+
+def predictSegments(baseString, numIterations, ruleDict, collapse=COLLAPSE_SEGMENTS):
+	''' predict the number of branch segments the turtle will build, without expanding the l-system
+
+	With collapse on a run of F and J symbols makes a single segment, so the segments are counted as the steps that
+	do not follow another step. Every symbol's expansion is summed up, one iteration at a time, by its number of segments
+	and whether it starts and ends with a step, the symbols the turtle ignores counting as neither.
+
+	baseString		: start string
+	numIterations	: how many times the rules will be used
+	ruleDict		: the dictionary holding the rules
+	collapse		: when True consecutive collinear segments are merged into one, as in interpretTurtle
+	return			: the number of segments
+	'''
+	alphabet = set(baseString).union(ruleDict, *ruleDict.values())
+	
+	#symbol: (segments, first and last drawing symbol of its expansion, True for a step, False for any other, None for none)
+	summary = {}
+	for symbol in alphabet:
+		if symbol in ('F', 'J'):
+			summary[symbol] = (1, True, True)
+		elif symbol in TURTLE_OPCODES:
+			summary[symbol] = (0, False, False)
+		else:
+			summary[symbol] = (0, None, None)
+	
+	def join(string):
+		segments, first, last = 0, None, None
+		for symbol in string:
+			count, symbolFirst, symbolLast = summary[symbol]
+			#a run carrying on from the symbol before is not a new segment
+			if collapse and last and symbolFirst:
+				count -= 1
+			segments += count
+			if first is None:
+				first = symbolFirst
+			if symbolLast is not None:
+				last = symbolLast
+		return segments, first, last
+	
+	for i in range(numIterations):
+		summary = dict((symbol, join(ruleDict[symbol]) if symbol in ruleDict else summary[symbol]) for symbol in alphabet)
+	return join(baseString)[0]
+
+def predictNodes(prediction, leaf, apple):
+	''' the size of a predicted tree, as counted against NODE_BUDGET
+
+	The leaves are counted before cullLeaves thins them, so the count is an upper bound.
+
+	prediction		: the dictionary returned by predictTree
+	leaf			: True when leaves are being built
+	apple			: True when apples are being built
+	return			: the number of branch segments plus the expected number of leaves and apples
+	'''
+	nodes = prediction['segments']
+	if leaf:
+		nodes += prediction['expectedLeaves']
+	if apple:
+		nodes += prediction['expectedApples']
+	return int(math.ceil(nodes))
+
+def fitNodeBudget(baseString, numIterations, ruleDict, leaf, apple, budget):
+	''' find the largest number of iterations, up to numIterations, whose predicted tree fits inside the node budget
+
+	baseString		: start string
+	numIterations	: the requested number of iterations
+	ruleDict		: the dictionary holding the rules
+	leaf			: True when leaves are being built
+	apple			: True when apples are being built
+	budget			: the largest size of the tree, as counted by predictNodes
+	return			: the number of iterations that fits, or 0 when not even a single iteration fits
+	'''
 	while numIterations > 0:
-		replaced = ""
-		for i in baseString:
-			replaced = replaced + ruleDict.get(i,i)
-		baseString = replaced
-		numIterations-=1
-	return baseString
+		if predictNodes(predictTree(baseString, numIterations, ruleDict), leaf, apple) <= budget:
+			return numIterations
+		numIterations -= 1
+	return 0
 	
 def createBranch(startPoint, length, angleZ, angleX, level):
 	''' create a cylinder for each branch
@@ -260,13 +1142,7 @@ def createBranch(startPoint, length, angleZ, angleX, level):
 	return		: return the created object
 	'''
 	
-	radiansZ = angleZ * math.pi /180.0
-	radiansX = angleX * math.pi /180.0
-	branch = cmds.polyCylinder(axis=[math.sin(radiansZ), math.cos(radiansZ)*math.cos(radiansX), math.cos(radiansZ)*math.sin(radiansX)], r=length/level, height=length)
-	
-	cmds.move(startPoint[0] + 0.5*length*math.sin(radiansZ), startPoint[1] + 0.5*length*math.cos(radiansZ)*math.cos(radiansX), startPoint[2]+0.5*length*math.cos(radiansZ)*math.sin(radiansX))
-	
-	return branch[0]
+	return createSegment(startPoint, calculateVector(1.0, angleZ, angleX), length, length/level)
 
 def calculateVector( length, angleZ, angleX ):
 	'''calculate the vector from the start point to the end point for each branch
@@ -280,139 +1156,1050 @@ def calculateVector( length, angleZ, angleX ):
 	radiansX = angleX * math.pi /180.0
 	return [height* math.sin(radiansZ), height* math.cos(radiansZ)*math.cos(radiansX), height*math.cos(radiansZ)*math.sin(radiansX)]	
 	
-def makeLeaf(temp, Point):
-    '''calculate the vector from the start point to the end point for each branch
+def createSegment(startPoint, direction, length, radius):
+	''' create a cylinder for one interpreted branch segment
 
-	temp		: the product of a random variable rls and the leafscale variable
-	Point    	: the current point in the tree generation
-	return		: return the name of the created leaf
+	startPoint	: base point of the segment
+	direction	: unit vector along the segment, used as the axis of the cylinder
+	length		: length of the segment
+	radius		: radius of the cylinder
+	return		: return the created object
 	'''
-    leafy = cmds.duplicate('leafy2')
-    rX = rand.uniform(-60,60)
-    rY = rand.uniform(0,360)
+	branch = cmds.polyCylinder(axis=[direction[0], direction[1], direction[2]], r=radius, height=length)
+	
+	cmds.move(startPoint[0] + 0.5*length*direction[0], startPoint[1] + 0.5*length*direction[1], startPoint[2] + 0.5*length*direction[2], branch[0])
+	
+	return branch[0]
 
-    cmds.scale( temp, temp, temp, leafy)
-    cmds.move(Point[0],Point[1],Point[2],leafy, r = True)
+def packTurtle(stepLength, starts, directions, lengths, levels, leafPoints, leafLevels, applePoints, appleLevels):
+	''' turn the lists gathered by the turtle into the arrays of an interpreted tree
 
-    cmds.rotate(rX,rY,0, leafy, a = True)
-    
-    return 'leafy*'
-        
-def makeApple(Point):
-    '''calculate the vector from the start point to the end point for each branch
+	stepLength							: step size for growing, the radius of a segment is stepLength/level
+	starts, directions, lengths, levels	: the per segment lists
+	leafPoints, leafLevels				: the per leaf candidate lists
+	applePoints, appleLevels			: the per apple candidate lists
+	return								: the dictionary of arrays described in interpretTurtle
+	'''
+	levels = np.array(levels, dtype=np.int32)
+	return {'starts': np.array(starts, dtype=np.float64).reshape(-1, 3),
+			'directions': np.array(directions, dtype=np.float64).reshape(-1, 3),
+			'lengths': np.array(lengths, dtype=np.float64),
+			'radii': stepLength / levels.astype(np.float64),
+			'levels': levels,
+			'leafPoints': np.array(leafPoints, dtype=np.float64).reshape(-1, 3),
+			'leafLevels': np.array(leafLevels, dtype=np.int32),
+			'applePoints': np.array(applePoints, dtype=np.float64).reshape(-1, 3),
+			'appleLevels': np.array(appleLevels, dtype=np.int32)}
 
-	Point    	: the current point in the tree generation
-	return		: return the name of the created apple
+def mergeTurtles(turtles):
+	''' join interpreted tree chunks from iterTurtleChunks back into a single interpreted tree
+
+	turtles		: the list of dictionaries to join, in order
+	return		: a single dictionary of arrays
 	'''
-    apple = cmds.duplicate('apple1')
+	if len(turtles) == 1:
+		return turtles[0]
+	return {key: np.concatenate([turtle[key] for turtle in turtles]) for key in turtles[0]}
 
-    cmds.scale( 0.1, 0.1, 0.1, apple)
-    cmds.move(Point[0],Point[1]-0.8,Point[2],apple)
-    return 'apple*'
-    
-def createModel( actionString, length, turn, leafscale, leaf, apple, progress):
-    
-   
-    '''create the 3D model based on the actionString, following the characters in the string, 
-    one by one, grow the branches, and finally group all branches together into one group
+def interpretTurtle(actionString, length, turn, progress=None, collapse=COLLAPSE_SEGMENTS):
+	''' walk the action string with a turtle and record the geometry it describes, without touching the scene
 
-      actionString	: instructions on how to construct the model
-      length		: step size for growing
-      turn			: the rotation angle for branching
-      leafscale		: a user selected leaf scaling factor 
-      leaf			: a boolean variable set to true when the leaf checkbox is on and false when its off
-      apple			: a boolean variable set to true when the apple checkbox is on and false when its off
-      progress		: the path name to the progress bar control to allow for editing
-      return		: return the group of all the branches, and the leaves and apples (assuming apples and leaves have been selected by the user)
-    '''
-    
-    inputString = actionString
-    index = 0		# Where at the input string we start from
-    angleX = 0
-    angleZ = 0		# Degrees, nor radians
-    currentPoint = [0.0, 0.0, 0.0]	# Start from origin
-    coordinateStack = []	# Stack where to store coordinates
-    angleXStack = []		# Stack to store angles
-    angleZStack = []		# Stack to store angles
-    branchList = []
-    leafList = []
-    appleList =[]
-    level = 1
-    
-    #random leaf scaler
-    rls = rand.uniform(1.0,1.3)
-    temp = leafscale*rls
-    
-    while ( index < len( inputString ) ):
-        if inputString[index] == 'F' or inputString[index] == 'J':
-            
-            rh = rand.uniform(0.7,1.2)
-            branch = createBranch(currentPoint, length, angleZ, angleX, level)
-            branchList.append(branch)
-            vector = calculateVector( length, angleZ, angleX )
-            newPoint = [currentPoint[0] + vector[0], currentPoint[1] + vector[1], currentPoint[2] + vector[2]]
-            currentPoint = newPoint	# update the position to go on growing from the new place
-            
-        elif inputString[index] == 'l' and leaf:
-            e= int(rand.uniform(0, level))
-            if not e == 0:
-                makeLeaf(temp, currentPoint)
-                leafList.append('leafy*')       
-         
-        elif inputString[index] == 'a' and apple:
-            e= int(rand.uniform(0, level))
-            if  e == 0:
-                makeApple(currentPoint)
-
-                appleList.append('apple*')
-            
-            #cmds.rotate( rand., 0, 0, r=True )
-        elif inputString[index] == '-':
-            angleZ = angleZ - turn
-        elif inputString[index] == '+':
-            angleZ = angleZ + turn
-        elif inputString[index] == '/':
-            angleX = angleX - turn
-        elif inputString[index] == '|':
-            angleX = angleX + turn
-        elif inputString[index] == '[': # add new branches, save the old position into the stack
-            coordinateStack.append( currentPoint )
-            angleZStack.append( angleZ )
-            angleXStack.append( angleX )
-            level+=1
-            cmds.progressBar(progress, edit=True, step=2)
-        elif inputString[index] == ']': # finish the branches, get back to the root position
-            currentPoint = coordinateStack.pop()
-            angleZ = angleZStack.pop()
-            angleX = angleXStack.pop()
-            level-=1
-        
-            #length = length * 0.99
-        # Move to the next drawing directive
-        index = index + 1
-    groupName = cmds.group(branchList, n = "tree")
-    
-    if apple:
-        cmds.group(appleList, n = "apples")
-    
-        cmds.delete('apple1')
-    cmds.progressBar(progress, edit=True, step= 500)
-    
-    if leaf:
-        leavesgroup =cmds.group(leafList, n = "leaves")
-        cmds.delete('leafy2')
-        
-        return groupName, leavesgroup
-   
-    
-    return groupName, "noleaves"
+	The result only holds plain NumPy arrays so it can be profiled, tested and reused outside Maya;
+	buildMayaTree turns it into scene geometry. Every 'l' and 'a' is recorded as a candidate together with
+	its level, deciding which of them actually grow is left to scatterLeaves and scatterApples.
 	
-def setMaterial(objName, objNameL, materialType, materialTypeL, treecolour, leavescolour, progress):
-   '''Assigns a material to the object 'objectName'
+	With collapse on, a run of F and J symbols with no turn, bracket, leaf or apple between them is recorded as a single
+	segment of the combined length, so the F -> FF rule does not build a straight limb out of dozens of coaxial cylinders.
+	The radius still comes from the step length, so the tree looks the same.
 
-      objName      : the group of cylinders making up the trunk and branches of the tree
-      objNameL     : the group of leave objects
-      materialType : is string that specifies the type of the sufrace shader of the tree(leaves and cyclinders), 
+	actionString	: instructions on how to construct the model, any iterable of symbols
+	length			: step size for growing
+	turn			: the rotation angle for branching
+	progress		: optional function called with the index of the symbol reached after every block of OPCODE_BLOCK symbols
+	collapse		: when True consecutive collinear segments are merged into one
+	return			: a dictionary of arrays, 'starts', 'directions' (unit vectors), 'lengths', 'radii' and 'levels' with one row per
+					  segment, 'leafPoints' and 'leafLevels' for the leaf candidates, 'applePoints' and 'appleLevels' for the apple candidates
+	'''
+	return mergeTurtles(list(iterTurtleChunks(actionString, length, turn, progress, collapse, 0)))
+
+def compileOpcodes(block):
+	''' compile a block of action string symbols into a compact array of turtle opcodes
+
+	Each drawing symbol is translated to its opcode in TURTLE_OPCODES and every other symbol, such as the rule
+	symbols A, B, C, D, G, K, H and Y, is dropped.
+
+	block		: a string of symbols
+	return		: the uint8 array of opcodes and the int64 array of the index in the block of the symbol of each opcode
+	'''
+	codes = np.frombuffer(block.translate(OPCODE_TABLE).encode('latin-1', 'replace'), dtype=np.uint8)
+	positions = np.flatnonzero(codes < OPCODE_COUNT)
+	return codes[positions], positions
+
+def iterOpcodeBlocks(actionString):
+	''' compile an action string into opcodes a block of OPCODE_BLOCK symbols at a time,
+	so a streamed string from iterateLazy is never held whole
+
+	actionString	: instructions on how to construct the model, any iterable of symbols
+	return			: a generator of (opcodes, symbol indices counted from the start of the string, index of the symbol after the block)
+	'''
+	if isinstance(actionString, str):
+		blocks = (actionString[start:start + OPCODE_BLOCK] for start in range(0, len(actionString), OPCODE_BLOCK))
+	else:
+		symbols = iter(actionString)
+		blocks = iter(lambda: ''.join(itertools.islice(symbols, OPCODE_BLOCK)), '')
+	offset = 0
+	for block in blocks:
+		codes, positions = compileOpcodes(block)
+		yield codes, positions + offset, offset + len(block)
+		offset += len(block)
+
+def runOpcodes(codes, carried, length, turn, collapse):
+	''' run the turtle over a block of opcodes at once with NumPy, instead of one symbol at a time
+
+	The turtle state is (x, y, z, angleZ, angleX), and every opcode adds a fixed change to it, except ']' which puts back
+	the state of its '['. That makes the state after each opcode a running sum, once every ']' is given the change
+	that undoes the opcodes directly inside its brackets, which are found by sorting the opcodes by bracket depth.
+	The angles are summed first, as they give the direction of each step, and the positions after.
+	The state of the branches still open at the end of the block is carried over to the next block,
+	by starting the block with a restore of those states, so no stack is kept symbol by symbol.
+
+	codes		: the opcodes of the block from compileOpcodes
+	carried		: the dictionary of turtle state carried from the block before: 'state', 'stack' of open branch states, 'extendable'
+	length		: step size for growing
+	turn		: the rotation angle for branching
+	collapse	: when True consecutive collinear segments are merged into one
+	return		: a dictionary of the block's segment 'heads' (indices into codes), 'starts', 'directions', 'lengths', 'levels',
+				  the 'leaves' and 'apples' (indices into codes), their 'leafPoints', 'leafLevels', 'applePoints', 'appleLevels',
+				  and 'extend', the length added to the last segment of the block before; carried is updated for the next block
+	'''
+	#the open branches and the current state are restored by a chain of state changes and pushes ahead of the block
+	restores = np.vstack((carried['stack'], carried['state'][None, :]))
+	prefix = 2 * len(restores) - 1
+	count = prefix + len(codes)
+	ops = np.full(count, OP_STATE, dtype=np.uint8)
+	ops[1:prefix:2] = OP_PUSH
+	ops[prefix:] = codes
+	restored = np.diff(restores, axis=0, prepend=np.zeros((1, 5)))
+	pointDeltas = np.zeros((count, 3))
+	pointDeltas[0:prefix:2] = restored[:, :3]
+	angleDeltas = np.zeros((count, 2))
+	angleDeltas[0:prefix:2] = restored[:, 3:]
+	
+	isPush = ops == OP_PUSH
+	isPop = ops == OP_POP
+	isStep = ops == OP_STEP
+	depth = np.cumsum(isPush.astype(np.int64) - isPop)
+	#the depth of the branch an opcode is in, a bracket counts as in the branch around it
+	depth[isPush] -= 1
+	
+	angleDeltas[ops == OP_LEFT, 0] = -turn
+	angleDeltas[ops == OP_RIGHT, 0] = turn
+	angleDeltas[ops == OP_DOWN, 1] = -turn
+	angleDeltas[ops == OP_UP, 1] = turn
+	
+	#pair every ']' with its '[', at the same depth they alternate in order
+	brackets = np.flatnonzero(isPush | isPop)
+	brackets = brackets[np.argsort(depth[brackets], kind='stable')]
+	closing = np.flatnonzero(isPop[brackets])
+	pops = brackets[closing]
+	pushes = brackets[closing - 1]
+	
+	#the opcodes directly inside each pair of brackets are one run in depth order
+	order = np.argsort(depth, kind='stable')
+	keys = depth[order] * (count + 1) + order
+	inner = (depth[pops] + 1) * (count + 1)
+	first = np.searchsorted(keys, inner + pushes, 'right')
+	last = np.searchsorted(keys, inner + pops, 'left')
+	
+	def runningState(deltas):
+		sums = np.zeros((count + 1, deltas.shape[1]))
+		np.cumsum(deltas[order], axis=0, out=sums[1:])
+		deltas[pops] = sums[first] - sums[last]
+		return np.cumsum(deltas, axis=0)
+	
+	angles = runningState(angleDeltas)
+	radiansZ = np.radians(angles[isStep, 0])
+	radiansX = np.radians(angles[isStep, 1])
+	cosZ = np.cos(radiansZ)
+	unit = np.stack((np.sin(radiansZ), cosZ * np.cos(radiansX), cosZ * np.sin(radiansX)), axis=1)
+	pointDeltas[isStep] = unit * length
+	points = runningState(pointDeltas)
+	
+	#a segment starts at every step, or with collapse on only at a step that does not follow another step
+	previousStep = np.concatenate(([False], isStep[:-1]))
+	previousStep[prefix] = carried['extendable']
+	isHead = isStep & ~(previousStep & collapse)
+	heads = np.flatnonzero(isHead)
+	runs = np.cumsum(isHead)[isStep]
+	leading = np.count_nonzero(runs == 0)
+	steps = np.bincount(runs[leading:] - 1, minlength=len(heads)) if collapse else np.ones(len(heads), dtype=np.int64)
+	
+	leaves = np.flatnonzero(ops == OP_LEAF)
+	apples = np.flatnonzero(ops == OP_APPLE)
+	result = {'heads': heads - prefix, 'starts': points[heads - 1], 'directions': unit[np.searchsorted(np.flatnonzero(isStep), heads)],
+			  'lengths': steps * float(length), 'levels': depth[heads] + 1, 'extend': leading * float(length),
+			  'leaves': leaves - prefix, 'leafPoints': points[leaves], 'leafLevels': depth[leaves] + 1,
+			  'apples': apples - prefix, 'applePoints': points[apples], 'appleLevels': depth[apples] + 1}
+	
+	#the branches left open are the pushes without a pop, their state is the state before them
+	opened = np.ones(count, dtype=bool)
+	opened[~isPush] = False
+	opened[pushes] = False
+	before = np.flatnonzero(opened) - 1
+	carried['stack'] = np.hstack((points[before], angles[before]))
+	carried['state'] = np.concatenate((points[-1], angles[-1]))
+	carried['extendable'] = bool(collapse and isStep[-1])
+	return result
+
+def iterTurtleChunks(actionString, length, turn, progress=None, collapse=COLLAPSE_SEGMENTS, chunkSize=TURTLE_CHUNK_SIZE):
+	''' walk the action string with a turtle like interpretTurtle, but hand the geometry over in chunks as it goes,
+	so a consumer such as an exporter can deal with each chunk and drop it before the turtle has finished
+
+	The string is compiled into opcodes and run by runOpcodes a block of OPCODE_BLOCK symbols at a time.
+	A chunk holds chunkSize segments and the leaf and apple candidates met before the next segment starts.
+
+	actionString	: instructions on how to construct the model, any iterable of symbols
+	length			: step size for growing
+	turn			: the rotation angle for branching
+	progress		: optional function called with the index of the symbol reached after every block
+	collapse		: when True consecutive collinear segments are merged into one
+	chunkSize		: the number of segments per chunk, 0 for a single chunk holding the whole tree
+	return			: a generator of dictionaries of arrays, laid out as described in interpretTurtle
+	'''
+	carried = {'state': np.zeros(5), 'stack': np.zeros((0, 5)), 'extendable': False}
+	keys = ('starts', 'directions', 'lengths', 'levels', 'leafPoints', 'leafLevels', 'applePoints', 'appleLevels')
+	#the order key each geometry key is split into chunks by
+	orderKeys = {'starts': 'segmentOrder', 'directions': 'segmentOrder', 'lengths': 'segmentOrder', 'levels': 'segmentOrder',
+				 'leafPoints': 'leafOrder', 'leafLevels': 'leafOrder', 'applePoints': 'appleOrder', 'appleLevels': 'appleOrder'}
+	#the geometry not handed over yet, and the symbol index of every segment, leaf and apple to split it into chunks by
+	pending = dict((key, []) for key in keys + ('segmentOrder', 'leafOrder', 'appleOrder'))
+	
+	def packPending(segmentEnd=None, orderEnd=None):
+		lists = {}
+		for key in pending:
+			lists[key] = np.concatenate(pending[key]) if pending[key] else np.zeros((0, 3) if key in ('starts', 'directions', 'leafPoints', 'applePoints') else 0)
+		if segmentEnd is None:
+			return packTurtle(length, *[lists[key] for key in keys])
+		cuts = {'segmentOrder': segmentEnd,
+				'leafOrder': np.searchsorted(lists['leafOrder'], orderEnd),
+				'appleOrder': np.searchsorted(lists['appleOrder'], orderEnd)}
+		for key in cuts:
+			pending[key] = [lists[key][cuts[key]:]]
+		chunk = []
+		for key in keys:
+			cut = cuts[orderKeys[key]]
+			chunk.append(lists[key][:cut])
+			pending[key] = [lists[key][cut:]]
+		return packTurtle(length, *chunk)
+	
+	segments = 0
+	for codes, positions, reached in iterOpcodeBlocks(actionString):
+		if not len(codes):
+			if progress is not None:
+				progress(reached)
+			continue
+		block = runOpcodes(codes, carried, length, turn, collapse)
+		if block['extend']:
+			#the block carried on the last segment of the blocks before
+			last = max(index for index, lengths in enumerate(pending['lengths']) if len(lengths))
+			pending['lengths'][last] = pending['lengths'][last].copy()
+			pending['lengths'][last][-1] += block['extend']
+		for key in keys:
+			pending[key].append(block[key])
+		pending['segmentOrder'].append(positions[block['heads']])
+		pending['leafOrder'].append(positions[block['leaves']])
+		pending['appleOrder'].append(positions[block['apples']])
+		segments += len(block['heads'])
+		
+		#a chunk is complete once the segment after its last one has started
+		while chunkSize and segments > chunkSize:
+			order = np.concatenate(pending['segmentOrder'])
+			yield packPending(chunkSize, order[chunkSize])
+			segments -= chunkSize
+		if progress is not None:
+			progress(reached)
+	
+	yield packPending()
+
+def cylinderMesh(starts, directions, lengths, radii, subdivisions=BRANCH_SUBDIVISIONS):
+	''' build the vertices and faces of one capped cylinder per segment in a single vectorized pass
+
+	Each cylinder has the same layout as a default polyCylinder: a ring of vertices at each end,
+	one quad per side and an n-sided cap at each end, with the faces wound so their normals point outwards.
+
+	starts			: (n, 3) array of segment base points
+	directions		: (n, 3) array of unit vectors along the segments
+	lengths			: (n,) array of segment lengths
+	radii			: (n,) array of cylinder radii
+	subdivisions	: the number of sides of each cylinder
+	return			: the (n*2*subdivisions, 3) vertex array, the face vertex counts and the flattened face vertex indices
+	'''
+	count = len(lengths)
+	
+	#two axes perpendicular to each direction, u x v == direction, seeded from x unless the direction is close to x
+	seed = np.zeros((count, 3))
+	nearX = np.abs(directions[:, 0]) > 0.9
+	seed[~nearX, 0] = 1.0
+	seed[nearX, 1] = 1.0
+	u = np.cross(seed, directions)
+	u /= np.linalg.norm(u, axis=1)[:, None]
+	v = np.cross(directions, u)
+	
+	#the template ring, scaled by the radius and laid out in the plane of u and v
+	theta = np.arange(subdivisions) * (2.0 * math.pi / subdivisions)
+	ring = (np.cos(theta)[None, :, None] * u[:, None, :] + np.sin(theta)[None, :, None] * v[:, None, :]) * radii[:, None, None]
+	bottom = starts[:, None, :] + ring
+	top = bottom + (directions * lengths[:, None])[:, None, :]
+	points = np.concatenate((bottom, top), axis=1).reshape(-1, 3)
+	
+	#the faces of one cylinder, offset by the first vertex of every segment
+	k = np.arange(subdivisions)
+	k1 = (k + 1) % subdivisions
+	sides = np.stack((k, k1, k1 + subdivisions, k + subdivisions), axis=1).ravel()
+	template = np.concatenate((sides, k[::-1], k + subdivisions))
+	faceConnects = (template[None, :] + (np.arange(count) * 2 * subdivisions)[:, None]).ravel()
+	faceCounts = np.tile(np.concatenate((np.full(subdivisions, 4), [subdivisions, subdivisions])), count)
+	return points, faceCounts.astype(np.int32), faceConnects.astype(np.int32)
+
+def createMesh(points, faceCounts, faceConnects, name):
+	''' create a single mesh object from vertex and face arrays with one API call
+
+	points			: (n, 3) vertex array
+	faceCounts		: the number of vertices of each face
+	faceConnects	: the vertex indices of every face, one after the other
+	name			: the name of the new mesh transform
+	return			: the name of the created mesh transform
+	'''
+	if om is None or isHeadless():
+		return cmds.record('MFnMesh.create', points=len(points), faces=len(faceCounts), name=name)
+	
+	transform = om.MFnMesh().create(om.MPointArray(points.tolist()), faceCounts.tolist(), faceConnects.tolist())
+	meshName = cmds.rename(om.MFnDagNode(transform).fullPathName(), name)
+	cmds.sets(meshName, edit=True, forceElement='initialShadingGroup')
+	return meshName
+
+def createBranchMeshes(turtle, perLevel=False, subdivisions=BRANCH_SUBDIVISIONS):
+	''' build every branch segment of an interpreted tree as one merged mesh, or one mesh per branch level
+
+	turtle			: the dictionary returned by interpretTurtle
+	perLevel		: when True each branch level gets its own mesh
+	subdivisions	: the number of sides of each cylinder
+	return			: the list of created mesh names
+	'''
+	if perLevel:
+		selections = [(turtle['levels'] == level, "branchesLevel%d" % level) for level in np.unique(turtle['levels'])]
+	else:
+		selections = [(slice(None), "branches")]
+	
+	meshes = []
+	for selection, name in selections:
+		points, faceCounts, faceConnects = cylinderMesh(turtle['starts'][selection], turtle['directions'][selection],
+														turtle['lengths'][selection], turtle['radii'][selection], subdivisions)
+		if len(faceCounts):
+			meshes.append(createMesh(points, faceCounts, faceConnects, name))
+	return meshes
+
+def randomStreams(seed, names=RANDOM_STREAMS):
+	''' create the random number streams of one tree, one independent NumPy generator per random quantity in RANDOM_STREAMS
+
+	Every quantity is drawn from its own stream in a single batch per tree (or per chunk, which draws the same values),
+	so the value given to a leaf or apple depends only on the seed and its position in the string,
+	never on what else was drawn or in which order the symbols were processed.
+
+	seed		: the integer seed of the tree, a sequence of integers, or None for a fresh unpredictable tree
+	names		: the names of the streams
+	return		: a dictionary of stream name to numpy.random.Generator
+	'''
+	children = np.random.SeedSequence(seed).spawn(len(names))
+	return dict(zip(names, [np.random.default_rng(child) for child in children]))
+
+def scatterLeaves(turtle, leafscale, rls=None, streams=None):
+	''' decide which leaf candidates grow a leaf and how each one is rotated, a leaf grows when int(uniform(0, level)) is not 0
+
+	turtle		: the dictionary returned by interpretTurtle
+	leafscale	: a user selected leaf scaling factor
+	rls			: the random leaf scaler, drawn from the 'leafScale' stream when it is not given
+	streams		: the random streams of the tree from randomStreams, fresh unseeded ones when not given
+	return		: a dictionary with the leaf 'points', their X and Y 'rotations' in degrees and the shared 'scale'
+	'''
+	if streams is None:
+		streams = randomStreams(None)
+	
+	#random leaf scaler
+	if rls is None:
+		rls = streams['leafScale'].uniform(1.0,1.3)
+	
+	#every candidate gets its draws whether it grows or not, so no leaf depends on the ones before it
+	levels = turtle['leafLevels']
+	accepted = np.floor(streams['leafAccept'].uniform(0.0, levels.astype(np.float64))) != 0
+	rotations = streams['leafRotation'].random((len(levels), 2)) * [120.0, 360.0] - [60.0, 0.0]
+	return {'points': turtle['leafPoints'][accepted],
+			'rotations': rotations[accepted],
+			'scale': leafscale*rls}
+
+def cullLeaves(leaves, cellSize=None, cellLimit=None, cellCounts=None):
+	''' thin out overlapping leaves, binning them into a spatial hash grid and keeping at most cellLimit leaves per cell
+
+	Leaves are kept in the order they were scattered, so the result is the same for the same tree and seed.
+	To cull a tree chunk by chunk, pass the same cellCounts dictionary to every chunk, the result is then the same as culling it whole.
+
+	leaves		: the dictionary returned by scatterLeaves
+	cellSize	: the edge length of a grid cell, LEAF_CELL_SIZE when not given
+	cellLimit	: the most leaves kept in a cell, LEAF_CELL_LIMIT when not given, 0 keeps every leaf
+	cellCounts	: a dictionary of grid cell to the number of leaves already kept in it, updated in place
+	return		: a dictionary like the one from scatterLeaves holding only the kept leaves
+	'''
+	cellSize = LEAF_CELL_SIZE if cellSize is None else cellSize
+	cellLimit = LEAF_CELL_LIMIT if cellLimit is None else cellLimit
+	points = leaves['points']
+	if not cellLimit or not len(points):
+		return leaves
+	if cellCounts is None:
+		cellCounts = {}
+	
+	cells, cellIndex = np.unique(np.floor(points / cellSize).astype(np.int64), axis=0, return_inverse=True)
+	cellIndex = cellIndex.reshape(-1)
+	#the rank of each leaf among the leaves of its cell, in scattering order, on top of the leaves kept there by earlier chunks
+	order = np.argsort(cellIndex, kind='stable')
+	firsts = np.searchsorted(cellIndex[order], np.arange(len(cells)))
+	rank = np.empty(len(points), dtype=np.int64)
+	rank[order] = np.arange(len(points)) - firsts[cellIndex[order]]
+	cellKeys = [tuple(cell) for cell in cells.tolist()]
+	earlier = np.array([cellCounts.get(key, 0) for key in cellKeys], dtype=np.int64)
+	kept = rank + earlier[cellIndex] < cellLimit
+	
+	added = np.bincount(cellIndex[kept], minlength=len(cells))
+	for key, count in zip(cellKeys, added.tolist()):
+		if count:
+			cellCounts[key] = cellCounts.get(key, 0) + count
+	return dict(leaves, points=points[kept], rotations=leaves['rotations'][kept])
+
+def lodTurtle(turtle, maxLevel):
+	''' the interpreted tree with the branches deeper than a branch level dropped, the leaf and apple candidates are left as they are
+
+	turtle		: the dictionary returned by interpretTurtle
+	maxLevel	: the deepest branch level kept, None keeps every branch
+	return		: a dictionary like turtle
+	'''
+	if maxLevel is None:
+		return turtle
+	kept = turtle['levels'] <= maxLevel
+	lod = dict(turtle)
+	for key in ('starts', 'directions', 'lengths', 'radii', 'levels'):
+		lod[key] = turtle[key][kept]
+	return lod
+
+def thinLeaves(leaves, fraction):
+	''' keep an evenly spread fraction of the leaves, scaled up so the canopy covers about the same area
+
+	leaves		: the dictionary returned by scatterLeaves or cullLeaves
+	fraction	: the fraction of the leaves kept, between 0 and 1
+	return		: a dictionary like leaves
+	'''
+	if fraction >= 1.0:
+		return leaves
+	index = np.arange(len(leaves['points']))
+	kept = np.floor((index + 1) * fraction) > np.floor(index * fraction)
+	return dict(leaves, points=leaves['points'][kept], rotations=leaves['rotations'][kept], scale=leaves['scale'] / math.sqrt(fraction))
+
+def leafBillboards(leaves, cellSize):
+	''' one card per grid cell holding leaves, at the middle of the leaves of that cell
+
+	leaves		: the dictionary returned by scatterLeaves or cullLeaves
+	cellSize	: the edge length of a grid cell, which is also the size of its card
+	return		: the (n, 3) array of card positions and the (n,) array of card scales
+	'''
+	points = leaves['points']
+	if not len(points):
+		return np.zeros((0, 3)), np.zeros(0)
+	cells, cellIndex = np.unique(np.floor(points / cellSize).astype(np.int64), axis=0, return_inverse=True)
+	cellIndex = cellIndex.reshape(-1)
+	counts = np.bincount(cellIndex)
+	centres = np.stack([np.bincount(cellIndex, weights=points[:, axis]) for axis in range(3)], axis=1) / counts[:, None]
+	return centres, np.full(len(cells), float(cellSize))
+
+def lodMeshes(turtle, leaves, apples, lod):
+	''' the meshes of one level of detail of a tree, for the exporters
+
+	turtle		: the dictionary returned by interpretTurtle
+	leaves		: the dictionary returned by cullLeaves, or None for no leaves
+	apples		: the array of apple points, or None for no apples
+	lod			: the index of the level of detail in LOD_SETTINGS
+	return		: a generator of (part, points, faceCounts, faceConnects) tuples where part is 'LOD<n>_branches', 'LOD<n>_leaves' or 'LOD<n>_apples'
+	'''
+	maxLevel, subdivisions, fraction, billboardCell = LOD_SETTINGS[lod]
+	branches = lodTurtle(turtle, maxLevel)
+	if len(branches['lengths']):
+		yield ('LOD%d_branches' % lod,) + cylinderMesh(branches['starts'], branches['directions'], branches['lengths'], branches['radii'], subdivisions)
+	if leaves is not None and len(leaves['points']):
+		if billboardCell:
+			positions, scales = leafBillboards(leaves, billboardCell)
+			yield ('LOD%d_leaves' % lod,) + instanceMesh(BILLBOARD_CARD[0], BILLBOARD_CARD[1], BILLBOARD_CARD[2], positions, np.zeros((len(positions), 3)), scales)
+		else:
+			thinned = thinLeaves(leaves, fraction)
+			rotations = np.zeros((len(thinned['points']), 3))
+			rotations[:, :2] = thinned['rotations']
+			yield ('LOD%d_leaves' % lod,) + instanceMesh(LEAF_CARD[0], LEAF_CARD[1], LEAF_CARD[2], thinned['points'], rotations, np.full(len(rotations), thinned['scale']))
+	#apples are too small to matter once the leaves are cards
+	if apples is not None and len(apples) and not billboardCell:
+		yield ('LOD%d_apples' % lod,) + instanceMesh(APPLE_MESH[0], APPLE_MESH[1], APPLE_MESH[2], apples - [0.0, 0.8, 0.0], np.zeros((len(apples), 3)), np.full(len(apples), 0.1))
+
+def scatterApples(turtle, streams=None):
+	''' decide which apple candidates grow an apple, an apple grows when int(uniform(0, level)) is 0
+
+	turtle		: the dictionary returned by interpretTurtle
+	streams		: the random streams of the tree from randomStreams, fresh unseeded ones when not given
+	return		: the array of apple points
+	'''
+	if streams is None:
+		streams = randomStreams(None)
+	levels = turtle['appleLevels']
+	return turtle['applePoints'][np.floor(streams['appleAccept'].uniform(0.0, levels.astype(np.float64))) == 0]
+
+def makeLeaf(temp, Point, rotation=None, template=None):
+    '''calculate the vector from the start point to the end point for each branch
+
+	temp		: the product of a random variable rls and the leafscale variable
+	Point    	: the current point in the tree generation
+	rotation	: the X and Y rotation of the leaf in degrees, picked at random when it is not given
+	template	: the name of the leaf template object, the default leaf from importLeafTemplate when not given
+	return		: return the name of the created leaf, it stays under the parent of the template, and hidden when the template is,
+				  until it is grouped
+	'''
+    if template is None:
+        template = importLeafTemplate(1)
+    leafy = cmds.duplicate(template, name='leafy1')[0]
+    if rotation is None:
+        rX = rand.uniform(-60,60)
+        rY = rand.uniform(0,360)
+    else:
+        rX, rY = rotation
+
+    cmds.scale( temp, temp, temp, leafy)
+    cmds.move(Point[0],Point[1],Point[2],leafy, r = True)
+
+    cmds.rotate(rX,rY,0, leafy, a = True)
+    
+    return leafy
+        
+def makeApple(Point, template=None):
+    '''calculate the vector from the start point to the end point for each branch
+
+	Point    	: the current point in the tree generation
+	template	: the name of the apple template object, from importAppleTemplate when not given
+	return		: return the name of the created apple, it stays under the parent of the template, and hidden when the template is,
+				  until it is grouped
+	'''
+    if template is None:
+        template = importAppleTemplate()
+    apple = cmds.duplicate(template, name='apple1')[0]
+
+    cmds.scale( 0.1, 0.1, 0.1, apple)
+    cmds.move(Point[0],Point[1]-0.8,Point[2],apple)
+    return apple
+    
+def createInstances(template, points, rotations, scales, name, indices=None):
+    '''place a copy of the template object at every point in one batch, with a particle point cloud driving an instancer,
+    so every copy shares the template's mesh instead of duplicating it
+
+	template	: the name of the object to instance, or a list of them when indices is given
+	points		: (n, 3) array of positions
+	rotations	: (n, 3) array of X, Y and Z rotations in degrees
+	scales		: (n, 3) array of X, Y and Z scales
+	name		: the base name of the created particle and instancer nodes
+	indices		: optional (n,) array of the index into the template list of the object placed at each point
+	return		: the list of created node names, the particle transform and the instancer
+	'''
+    particle = cmds.particle(p=[tuple(p) for p in points.tolist()], n=name+"Points")
+    shape = particle[1]
+    
+    # per-particle rotation and scale, set on both the initial state and the current state attributes
+    for attribute, values in (('rotationPP', rotations), ('scalePP', scales)):
+        for suffix in ('', '0'):
+            cmds.addAttr(shape, longName=attribute+suffix, dataType='vectorArray')
+            cmds.setAttr(shape+'.'+attribute+suffix, len(values), *[tuple(v) for v in values.tolist()], type='vectorArray')
+    
+    if indices is None:
+        instancer = cmds.particleInstancer(shape, addObject=True, object=template, position='worldPosition', rotation='rotationPP', scale='scalePP', name=name+"Instancer")
+    else:
+        for suffix in ('', '0'):
+            cmds.addAttr(shape, longName='objectIndexPP'+suffix, dataType='doubleArray')
+            cmds.setAttr(shape+'.objectIndexPP'+suffix, np.asarray(indices, dtype=np.float64).tolist(), type='doubleArray')
+        instancer = cmds.particleInstancer(shape, addObject=True, object=template, position='worldPosition', rotation='rotationPP', scale='scalePP',
+                                           objectIndex='objectIndexPP', name=name+"Instancer")
+    cmds.hide(template)
+    return [particle[0], instancer]
+
+def makeLeafInstances(leaves, template=None):
+    '''instance the leaf template at every scattered leaf, with the same rotation and scale makeLeaf would give it
+
+	leaves		: the dictionary returned by scatterLeaves
+	template	: the name of the leaf template object, the default leaf from importLeafTemplate when not given
+	return		: the list of created node names
+	'''
+    if template is None:
+        template = importLeafTemplate(1)
+    count = len(leaves['points'])
+    rotations = np.zeros((count, 3))
+    rotations[:, :2] = leaves['rotations']
+    return createInstances(template, leaves['points'], rotations, np.full((count, 3), leaves['scale']), "leaf")
+
+def makeAppleInstances(points, template=None):
+    '''instance the apple template at every apple point, placed and scaled the same way as makeApple
+
+	points		: (n, 3) array of apple points
+	template	: the name of the apple template object, from importAppleTemplate when not given
+	return		: the list of created node names
+	'''
+    if template is None:
+        template = importAppleTemplate()
+    return createInstances(template, points - [0.0, 0.8, 0.0], np.zeros((len(points), 3)), np.full((len(points), 3), 0.1), "apple")
+    
+def rotationMatrices(rotations):
+	''' build one rotation matrix per row of X, Y, Z rotations, applied in Maya's default xyz order
+
+	rotations	: (n, 3) array of rotations in degrees
+	return		: (n, 3, 3) array of rotation matrices
+	'''
+	rx, ry, rz = np.radians(rotations).T
+	cx, sx, cy, sy, cz, sz = np.cos(rx), np.sin(rx), np.cos(ry), np.sin(ry), np.cos(rz), np.sin(rz)
+	one, zero = np.ones_like(rx), np.zeros_like(rx)
+	matrixX = np.stack((one, zero, zero, zero, cx, -sx, zero, sx, cx), axis=1).reshape(-1, 3, 3)
+	matrixY = np.stack((cy, zero, sy, zero, one, zero, -sy, zero, cy), axis=1).reshape(-1, 3, 3)
+	matrixZ = np.stack((cz, -sz, zero, sz, cz, zero, zero, zero, one), axis=1).reshape(-1, 3, 3)
+	return matrixZ @ matrixY @ matrixX
+
+def instanceMesh(points, faceCounts, faceConnects, positions, rotations, scales):
+	''' copy a template mesh to every position with its own rotation and uniform scale, as one combined mesh
+
+	points			: (v, 3) template vertex array
+	faceCounts		: the template face vertex counts
+	faceConnects	: the template face vertex indices
+	positions		: (n, 3) array of positions
+	rotations		: (n, 3) array of X, Y and Z rotations in degrees
+	scales			: (n,) array of uniform scales
+	return			: the combined vertex array, face vertex counts and face vertex indices
+	'''
+	count = len(positions)
+	placed = np.einsum('nij,vj->nvi', rotationMatrices(rotations), points) * np.asarray(scales)[:, None, None] + positions[:, None, :]
+	connects = (faceConnects[None, :] + (np.arange(count) * len(points))[:, None]).ravel()
+	return placed.reshape(-1, 3), np.tile(faceCounts, count), connects
+
+def treeMeshChunks(turtleChunks, leafscale, leaf, apple, subdivisions=BRANCH_SUBDIVISIONS, streams=None):
+	''' turn the chunks of an interpreted tree into mesh chunks of branches, leaves and apples, ready to be written out
+
+	Leaves are built from LEAF_CARD and apples from APPLE_MESH, placed the same way makeLeaf and makeApple place the
+	Maya templates, so the trees can be exported without Maya or the template scenes.
+
+	turtleChunks	: an iterable of dictionaries from iterTurtleChunks
+	leafscale		: a user selected leaf scaling factor
+	leaf			: True when leaves are built
+	apple			: True when apples are built
+	subdivisions	: the number of sides of each branch cylinder
+	streams			: the random streams of the tree from randomStreams, fresh unseeded ones when not given
+	return			: a generator of (part, points, faceCounts, faceConnects) tuples where part is 'branches', 'leaves' or 'apples'
+	'''
+	if streams is None:
+		streams = randomStreams(None)
+	
+	#random leaf scaler, shared by the whole tree
+	rls = streams['leafScale'].uniform(1.0,1.3)
+	#the leaves kept in each grid cell so far, so chunks are culled as if the tree was whole
+	cellCounts = {}
+	
+	for turtle in turtleChunks:
+		if len(turtle['lengths']):
+			yield ('branches',) + cylinderMesh(turtle['starts'], turtle['directions'], turtle['lengths'], turtle['radii'], subdivisions)
+		if leaf:
+			leaves = cullLeaves(scatterLeaves(turtle, leafscale, rls, streams), cellCounts=cellCounts)
+			if len(leaves['points']):
+				rotations = np.zeros((len(leaves['points']), 3))
+				rotations[:, :2] = leaves['rotations']
+				yield ('leaves',) + instanceMesh(LEAF_CARD[0], LEAF_CARD[1], LEAF_CARD[2], leaves['points'], rotations, np.full(len(rotations), leaves['scale']))
+		if apple:
+			apples = scatterApples(turtle, streams)
+			if len(apples):
+				yield ('apples',) + instanceMesh(APPLE_MESH[0], APPLE_MESH[1], APPLE_MESH[2], apples - [0.0, 0.8, 0.0], np.zeros((len(apples), 3)), np.full(len(apples), 0.1))
+
+def facesBySize(faceCounts, faceConnects):
+	''' group the faces of a mesh by their number of vertices, so each group can be handled as one 2D array
+
+	faceCounts		: the face vertex counts
+	faceConnects	: the face vertex indices
+	return			: a generator of (size, (faces, size) array of vertex indices)
+	'''
+	firsts = np.cumsum(faceCounts) - faceCounts
+	for size in np.unique(faceCounts):
+		yield size, faceConnects[firsts[faceCounts == size][:, None] + np.arange(size)]
+
+def triangulate(faceCounts, faceConnects):
+	''' fan triangulate the faces of a mesh
+
+	faceCounts		: the face vertex counts
+	faceConnects	: the face vertex indices
+	return			: (t, 3) array of triangle vertex indices
+	'''
+	triangles = [faces[:, [0, k, k + 1]] for size, faces in facesBySize(faceCounts, faceConnects) for k in range(1, size - 1)]
+	if not triangles:
+		return np.zeros((0, 3), dtype=np.uint32)
+	return np.concatenate(triangles)
+
+def writeOBJ(path, meshChunks):
+	''' stream mesh chunks straight into a Wavefront OBJ file, each chunk is written and dropped before the next is made
+
+	path		: the file to write
+	meshChunks	: an iterable of (part, points, faceCounts, faceConnects) tuples, e.g. from treeMeshChunks
+	return		: the number of vertices and faces written
+	'''
+	vertices = 0
+	faces = 0
+	with open(path, 'w') as objFile:
+		objFile.write("# TreeGen L-system tree\n")
+		for part, points, faceCounts, faceConnects in meshChunks:
+			objFile.write("g %s\n" % part)
+			np.savetxt(objFile, points, fmt='v %.6f %.6f %.6f')
+			#obj indices count from 1 across the whole file
+			for size, indices in facesBySize(faceCounts, faceConnects + vertices + 1):
+				np.savetxt(objFile, indices, fmt='f' + ' %d' * size)
+			vertices += len(points)
+			faces += len(faceCounts)
+	return vertices, faces
+
+def writeGLB(path, meshChunks, colours=None):
+	''' stream mesh chunks into a binary glTF (GLB) file, with one primitive per part
+
+	The GLB header needs the final sizes, so the vertex and index data of each part is streamed into temporary
+	files as the chunks arrive and then copied in after the header, without the whole mesh ever being held in memory.
+
+	path		: the file to write
+	meshChunks	: an iterable of (part, points, faceCounts, faceConnects) tuples, e.g. from treeMeshChunks
+	colours		: optional dictionary of part name to (R,G,B) values within the range [0,1]
+	return		: the number of vertices and triangles written
+	'''
+	colours = colours or {}
+	parts = collections.OrderedDict()
+	try:
+		for part, points, faceCounts, faceConnects in meshChunks:
+			if part not in parts:
+				parts[part] = {'points': tempfile.TemporaryFile(), 'indices': tempfile.TemporaryFile(), 'vertices': 0,
+							   'min': np.full(3, np.inf, dtype='<f4'), 'max': np.full(3, -np.inf, dtype='<f4')}
+			record = parts[part]
+			#the bounds are taken from the stored float32 values, glTF requires them to match the buffer exactly
+			points = points.astype('<f4')
+			record['points'].write(points.tobytes())
+			record['indices'].write((triangulate(faceCounts, faceConnects) + record['vertices']).astype('<u4').tobytes())
+			record['vertices'] += len(points)
+			record['min'] = np.minimum(record['min'], points.min(axis=0))
+			record['max'] = np.maximum(record['max'], points.max(axis=0))
+		
+		#lay the parts out one after the other in the binary chunk, positions then indices, all 4 byte aligned
+		gltf = {'asset': {'version': '2.0', 'generator': 'TreeGen'}, 'scene': 0, 'scenes': [{'nodes': [0]}],
+				'nodes': [{'name': 'tree'}], 'buffers': [], 'bufferViews': [], 'accessors': [], 'materials': [], 'meshes': []}
+		primitives = []
+		offset = 0
+		triangles = 0
+		for part, record in parts.items():
+			pointBytes = record['points'].tell()
+			indexBytes = record['indices'].tell()
+			gltf['bufferViews'].append({'buffer': 0, 'byteOffset': offset, 'byteLength': pointBytes, 'target': 34962})
+			gltf['bufferViews'].append({'buffer': 0, 'byteOffset': offset + pointBytes, 'byteLength': indexBytes, 'target': 34963})
+			offset += pointBytes + indexBytes
+			gltf['accessors'].append({'bufferView': len(gltf['bufferViews']) - 2, 'componentType': 5126, 'count': record['vertices'], 'type': 'VEC3',
+									  'min': record['min'].tolist(), 'max': record['max'].tolist()})
+			gltf['accessors'].append({'bufferView': len(gltf['bufferViews']) - 1, 'componentType': 5125, 'count': indexBytes // 4, 'type': 'SCALAR'})
+			colour = list(colours.get(part, (0.5, 0.5, 0.5)))
+			gltf['materials'].append({'name': part, 'pbrMetallicRoughness': {'baseColorFactor': colour + [1.0], 'metallicFactor': 0.0}})
+			primitives.append({'attributes': {'POSITION': len(gltf['accessors']) - 2}, 'indices': len(gltf['accessors']) - 1,
+							   'material': len(gltf['materials']) - 1})
+			triangles += indexBytes // 12
+		if primitives:
+			gltf['meshes'].append({'name': 'tree', 'primitives': primitives})
+			gltf['nodes'][0]['mesh'] = 0
+			gltf['buffers'].append({'byteLength': offset})
+		for key in ('buffers', 'bufferViews', 'accessors', 'materials', 'meshes'):
+			if not gltf[key]:
+				del gltf[key]
+		
+		jsonChunk = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+		jsonChunk += b' ' * (-len(jsonChunk) % 4)
+		total = 12 + 8 + len(jsonChunk) + (8 + offset if primitives else 0)
+		with open(path, 'wb') as glbFile:
+			glbFile.write(struct.pack('<4sII', b'glTF', 2, total))
+			glbFile.write(struct.pack('<I4s', len(jsonChunk), b'JSON'))
+			glbFile.write(jsonChunk)
+			if primitives:
+				glbFile.write(struct.pack('<I4s', offset, b'BIN\x00'))
+				for record in parts.values():
+					for key in ('points', 'indices'):
+						record[key].seek(0)
+						shutil.copyfileobj(record[key], glbFile)
+	finally:
+		for record in parts.values():
+			record['points'].close()
+			record['indices'].close()
+	return sum(record['vertices'] for record in parts.values()), triangles
+
+def exportTree(path, actionString, length, turn, leafscale, leaf, apple, colours=None, seed=None, turtle=None):
+	''' export a tree straight from its action string to an OBJ or GLB file, picked from the file extension, without
+	building anything in the Maya scene; the turtle, mesh building and writing run chunk by chunk,
+	so with an iterateLazy action string the full tree is never held in memory
+
+	path			: the file to write, ending in .obj or .glb
+	actionString	: instructions on how to construct the model, any iterable of symbols
+	length			: step size for growing
+	turn			: the rotation angle for branching
+	leafscale		: a user selected leaf scaling factor
+	leaf			: True when leaves are exported
+	apple			: True when apples are exported
+	colours			: optional dictionary of part name ('branches', 'leaves', 'apples') to (R,G,B), used by GLB
+	seed			: the seed of the tree's random streams, None for a fresh unpredictable tree
+	turtle			: the interpreted tree when it is already known, e.g. from the geometry cache, the action string is then not used
+	return			: the number of vertices and faces (OBJ) or triangles (GLB) written
+	'''
+	turtleChunks = [turtle] if turtle is not None else iterTurtleChunks(actionString, length, turn)
+	meshChunks = treeMeshChunks(turtleChunks, leafscale, leaf, apple, streams=randomStreams(seed))
+	if path.lower().endswith('.glb'):
+		return writeGLB(path, meshChunks, colours)
+	return writeOBJ(path, meshChunks)
+	
+def exportLods(path, actionString, length, turn, leafscale, leaf, apple, colours=None, seed=None, turtle=None):
+	''' export every level of detail in LOD_SETTINGS of a tree into one OBJ or GLB file, picked from the file extension,
+	with the parts of each level named 'LOD<n>_branches', 'LOD<n>_leaves' and 'LOD<n>_apples'
+
+	All the levels come from one turtle pass and one scattering of the leaves and apples, so they are the same tree,
+	LOD0 is the same as the tree written by exportTree.
+
+	the arguments are the same as those of exportTree
+	return			: the number of vertices and faces (OBJ) or triangles (GLB) written
+	'''
+	if turtle is None:
+		turtle = interpretTurtle(actionString, length, turn)
+	streams = randomStreams(seed)
+	rls = streams['leafScale'].uniform(1.0,1.3)
+	leaves = cullLeaves(scatterLeaves(turtle, leafscale, rls, streams)) if leaf else None
+	apples = scatterApples(turtle, streams) if apple else None
+	
+	meshChunks = (mesh for lod in range(len(LOD_SETTINGS)) for mesh in lodMeshes(turtle, leaves, apples, lod))
+	if path.lower().endswith('.glb'):
+		lodColours = dict(('LOD%d_%s' % (lod, part), colour) for lod in range(len(LOD_SETTINGS)) for part, colour in (colours or {}).items())
+		return writeGLB(path, meshChunks, lodColours)
+	return writeOBJ(path, meshChunks)
+	
+def createModel( actionString, length, turn, leafscale, leaf, apple, progress, leaftype=1):
+    
+   
+    '''create the 3D model based on the actionString, following the characters in the string, 
+    one by one, grow the branches, and finally group all branches together into one group
+
+      actionString	: instructions on how to construct the model, any iterable of symbols (a string or the iterateLazy generator)
+      length		: step size for growing
+      turn			: the rotation angle for branching
+      leafscale		: a user selected leaf scaling factor 
+      leaf			: a boolean variable set to true when the leaf checkbox is on and false when its off
+      apple			: a boolean variable set to true when the apple checkbox is on and false when its off
+      progress		: the path name to the progress bar control to allow for editing
+      leaftype		: the value of the leaves control, 1 for the default leaf and 2 for the maple leaf
+      return		: return the group of all the branches, and the leaves and apples (assuming apples and leaves have been selected by the user)
+    '''
+    
+    reporter = ProgressReporter(progress, len(actionString) if hasattr(actionString, '__len__') else 0)
+    try:
+        turtle = interpretTurtle(actionString, length, turn, reporter)
+    finally:
+        reporter.finish()
+    
+    return buildMayaTree(turtle, leafscale, leaf, apple, progress, leaftype)
+
+def buildMayaTree(turtle, leafscale, leaf, apple, progress, leaftype=1):
+    '''the Maya backend, build the scene objects for a tree interpreted by interpretTurtle
+    
+      turtle		: the dictionary returned by interpretTurtle
+      leafscale		: a user selected leaf scaling factor 
+      leaf			: a boolean variable set to true when the leaf checkbox is on and false when its off
+      apple			: a boolean variable set to true when the apple checkbox is on and false when its off
+      progress		: the path name to the progress bar control to allow for editing
+      leaftype		: the value of the leaves control, 1 for the default leaf and 2 for the maple leaf
+      return		: return the group of all the branches, and the leaves and apples (assuming apples and leaves have been selected by the user)
+    '''
+    groupName = buildBranches(turtle)
+    
+    if apple:
+        buildApples(turtle, template=importAppleTemplate())
+    cmds.progressBar(progress, edit=True, step= 500)
+    
+    if leaf:
+        leavesgroup = buildLeaves(turtle, leafscale, template=importLeafTemplate(leaftype))
+        
+        return groupName, leavesgroup
+   
+    
+    return groupName, "noleaves"
+
+def buildBranches(turtle):
+    '''build the branches of an interpreted tree, as set by BRANCH_MESH, and group them
+    
+      turtle		: the dictionary returned by interpretTurtle
+      return		: the name of the group holding the branches
+    '''
+    branchList = []
+    
+    if BRANCH_MESH == 'cylinders':
+        for start, direction, length, radius in zip(turtle['starts'], turtle['directions'], turtle['lengths'], turtle['radii']):
+            branchList.append(createSegment(start, direction, length, radius))
+    else:
+        branchList = createBranchMeshes(turtle, perLevel = BRANCH_MESH == 'level')
+    
+    return cmds.group(branchList, n = "tree")
+
+def buildLeaves(turtle, leafscale, streams=None, template=None, leaves=None):
+    '''scatter the leaves of an interpreted tree from a leaf template and group them, the template itself is left as it is
+    
+      turtle		: the dictionary returned by interpretTurtle
+      leafscale		: a user selected leaf scaling factor 
+      streams		: the random streams of the tree from randomStreams, fresh unseeded ones when not given
+      template		: the name of the leaf template object, the default leaf from importLeafTemplate when not given
+      leaves		: the leaves already scattered and culled, e.g. from the geometry cache, instead of scattering them here
+      return		: the name of the group holding the leaves
+    '''
+    leafList = []
+    
+    if template is None:
+        template = importLeafTemplate(1)
+    if leaves is None:
+        leaves = cullLeaves(scatterLeaves(turtle, leafscale, streams=streams))
+    profileCount('leaves', len(leaves['points']))
+    if LEAF_MODE == 'instanced':
+        leafList = makeLeafInstances(leaves, template)
+    else:
+        leafList = [makeLeaf(leaves['scale'], point, rotation, template) for point, rotation in zip(leaves['points'], leaves['rotations'])]
+        if leafList:
+            cmds.showHidden(leafList)
+    
+    # the exact names are grouped in one call, out from under the template's hidden group
+    # an empty list would group the selection instead
+    if not leafList:
+        return cmds.group(empty=True, n = "leaves")
+    leavesgroup =cmds.group(leafList, n = "leaves", world=True)
+    return leavesgroup
+
+def buildApples(turtle, streams=None, template=None, apples=None):
+    '''scatter the apples of an interpreted tree from an apple template and group them, the template itself is left as it is
+    
+      turtle		: the dictionary returned by interpretTurtle
+      streams		: the random streams of the tree from randomStreams, fresh unseeded ones when not given
+      template		: the name of the apple template object, from importAppleTemplate when not given
+      apples		: the apple points already scattered, e.g. from the geometry cache, instead of scattering them here
+      return		: the name of the group holding the apples
+    '''
+    appleList =[]
+    
+    if template is None:
+        template = importAppleTemplate()
+    if apples is None:
+        apples = scatterApples(turtle, streams)
+    profileCount('apples', len(apples))
+    if LEAF_MODE == 'instanced':
+        appleList = makeAppleInstances(apples, template)
+    else:
+        appleList = [makeApple(point, template) for point in apples]
+        if appleList:
+            cmds.showHidden(appleList)
+    
+    if not appleList:
+        return cmds.group(empty=True, n = "apples")
+    applesgroup = cmds.group(appleList, n = "apples", world=True)
+    return applesgroup
+
+def buildLods(turtle, params, progress):
+    '''build the lower levels of detail of a tree, LOD1 onwards in LOD_SETTINGS, from the turtle of the tree already built as LOD0
+    
+    The leaves and apples are scattered from the same seed as the full tree and then thinned, so every level is the same tree.
+    LOD0 is the tree itself, it stays in its own 'tree', 'leaves' and 'apples' groups so the stages of buildTree
+    find it in the same place whether the lower levels are built or not.
+    
+      turtle		: the dictionary returned by interpretTurtle
+      params		: the parameters of the tree, as read by readParameters
+      progress		: the path name to the progress bar control to allow for editing
+      return		: the name of the group holding one 'LOD<n>' group per level, and the (branch meshes, leaf cards)
+					  given the materials, so a change of materials alone can reassign them
+    '''
+    streams = randomStreams(params['seed'])
+    leaves = cullLeaves(scatterLeaves(turtle, params['leafscale'], streams=streams)) if params['leaf'] else None
+    apples = scatterApples(turtle, streams) if params['apple'] else None
+    
+    lodGroups = []
+    branchList = []
+    cardList = []
+    for lod in range(1, len(LOD_SETTINGS)):
+        maxLevel, subdivisions, fraction, billboardCell = LOD_SETTINGS[lod]
+        members = createBranchMeshes(lodTurtle(turtle, maxLevel), subdivisions=subdivisions)
+        branchList += members
+        if leaves is not None and len(leaves['points']):
+            if billboardCell:
+                positions, scales = leafBillboards(leaves, billboardCell)
+                cards = createMesh(*instanceMesh(BILLBOARD_CARD[0], BILLBOARD_CARD[1], BILLBOARD_CARD[2], positions, np.zeros((len(positions), 3)), scales), name="leafCards")
+                members.append(cards)
+                cardList.append(cards)
+            else:
+                members += makeLeafInstances(thinLeaves(leaves, fraction), importLeafTemplate(params['leaftype']))
+        if apples is not None and len(apples) and not billboardCell:
+            members += makeAppleInstances(apples, importAppleTemplate())
+        lodGroups.append(cmds.group(members, n = "LOD%d" % lod))
+    
+    #the thinned leaves are instances of the template, which already has the leaf material, only the cards need it
+    setMaterial(branchList, cardList or "noleaves", params['material'], params['leafmaterial'], params['rgb'], params['leavesrgb'], progress)
+    return cmds.group(lodGroups, n = "lods"), (branchList, cardList)
+	
+def getShader(materialType, colour):
+   '''the shading group and shader of a material type and colour, taken from the shader pool when it already holds one
+
+      materialType : the type of Maya surface shader, e.g. lambert, blinn or phong
+      colour       : the (R,G,B) values within the range [0,1], colours equal to SHADER_COLOUR_DIGITS decimals share a shader
+      return       : the names of the shading group and the shader
+   '''
+   key = (materialType,) + tuple(round(value, SHADER_COLOUR_DIGITS) for value in colour)
+   if key in shaderPool and cmds.objExists(shaderPool[key][0]):
+       return shaderPool[key]
+   
+   # create a new set
+   setName = cmds.sets(name='_MaterialGroup_', renderable=True, empty=True)
+   
+   # create a new shading node
+   shaderName = cmds.shadingNode(materialType, asShader=True)
+   
+   # change its colour
+   cmds.setAttr(shaderName+'.color', key[1], key[2], key[3], type='double3')
+   
+   # add to the list of surface shaders
+   cmds.surfaceShaderList(shaderName, add=setName)
+   
+   shaderPool[key] = (setName, shaderName)
+   return shaderPool[key]
+
+def deleteUnusedShaders(keep=()):
+   '''delete the shading groups of the shader pool that no longer have any members, and their shaders
+
+      keep         : the names of shading groups to keep even when they are empty
+      return       : the number of shaders deleted
+   '''
+   deleted = 0
+   for key, (setName, shaderName) in list(shaderPool.items()):
+       if setName in keep:
+           continue
+       if cmds.objExists(setName) and cmds.sets(setName, query=True):
+           continue
+       if cmds.objExists(setName):
+           cmds.delete(setName, shaderName)
+       del shaderPool[key]
+       deleted += 1
+   return deleted
+
+def setMaterial(objName, objNameL, materialType, materialTypeL, treecolour, leavescolour, progress):
+   '''Assigns a material to the object 'objectName'
+
+      objName      : the group of cylinders making up the trunk and branches of the tree, or a list of branch objects
+      objNameL     : the group of leave objects, or a list of them
+      materialType : is string that specifies the type of the sufrace shader of the tree(leaves and cyclinders), 
                      this can be any of Maya's valid surface shaders such as:
                      lambert, blin, phong, etc.
       treecolour   : is a list of (R,G,B) values within the range [0,1]
@@ -420,45 +2207,33 @@ def setMaterial(objName, objNameL, materialType, materialTypeL, treecolour, leav
       leavescolour : is a list of (R,G,B) values within the range [0,1]
                      which specify the colour of the leaves
       progress     : the path name to the progress bar control to allow for editing
-      On Exit      : 'objName' and 'objNameL' have been assigned a new material according to the 
+      On Exit      : 'objName' and 'objNameL' have been assigned a material from the shader pool according to the 
                      input values of the procedure, and two tuples (both of two strings) 
-                     which contain the new shading group name, and the new shader
+                     which contain the shading group name, and the shader
                      name are returned to the caller
 	'''
-   cmds.progressBar(progress, edit=True, pr=8000*0.6)
+   cmds.progressBar(progress, edit=True, pr=PROGRESS_MAX*0.6)
    
-   # create a new set
-   setName = cmds.sets(name='_MaterialGroup_', renderable=True, empty=True)
+   # the objects of each shading group, so each group is assigned in a single sets call
+   assignments = collections.OrderedDict()
    
-   # create a new shading node
-   shaderName = cmds.shadingNode(materialType, asShader=True)
+   material = getShader(materialType, treecolour)
+   assignments.setdefault(material[0], []).extend(objName if isinstance(objName, list) else [objName])
+   cmds.progressBar(progress, edit=True, pr=PROGRESS_MAX*0.8)
    
-   # change its colour
-   cmds.setAttr(shaderName+'.color', treecolour[0], treecolour[1], treecolour[2], type='double3')
+   materialL = None
+   if not objNameL == "noleaves":
+       materialL = getShader(materialTypeL, leavescolour)
+       assignments.setdefault(materialL[0], []).extend(objNameL if isinstance(objNameL, list) else [objNameL])
    
-   # add to the list of surface shaders
-   cmds.surfaceShaderList(shaderName, add=setName)
+   for setName, members in assignments.items():
+       cmds.sets(members, edit=True, forceElement=setName)
    
-   # assign the material to the object
-   cmds.sets(objName, edit=True, forceElement=setName)
-   cmds.progressBar(progress, edit=True, pr=8000*0.8)
+   if DELETE_UNUSED_SHADERS:
+       deleteUnusedShaders(keep=assignments)
    
-   if not objNameL == "noleaves":
-        # create a new set
-       setNameL = cmds.sets(name='_MaterialGroup_1', renderable=True, empty=True)
-       
-       # create a new shading node
-       shaderNameL = cmds.shadingNode(materialTypeL, asShader=True)
-       
-       # change its colour
-       cmds.setAttr(shaderNameL+'.color', leavescolour[0], leavescolour[1], leavescolour[2], type='double3')
-       
-       # add to the list of surface shaders
-       cmds.surfaceShaderList(shaderNameL, add=setNameL)
-       
-       cmds.sets(objNameL, edit=True, forceElement=setNameL)
-       
-   cmds.progressBar(progress, pr = 8000,  edit=True)
+   cmds.progressBar(progress, pr = PROGRESS_MAX,  edit=True)
+   return material, materialL
    
 def treetype(cv, cv2):
 	'''creates the axiom corresponding to the user selected axiom and adds the rules of that axiom '
@@ -515,94 +2290,880 @@ def materialtype(cv):
 	    material = "phong"
 	return material
 	
-def treegen( plength, piterations, ptreetype, pmaterialtype, prgbs, pleafscale, pleavesamount, prgbleaves, papplecheck, pleafcheck, pangle, pleaves, ptreetype2, progress, pleafmaterial, *pArgs):
-	'''using the user inputs from createUI to set the variable that will define the characteristics of the tree
+def presetRules(preset, thicker=False):
+	''' the axiom and rules of a named tree preset, the same as picking it in the user interface
+
+	preset		: one of the names in TREE_PRESETS
+	thicker		: when True the l = ll rule is added, as with the 'Thicker' leaves option
+	return		: the axiom and the ruledictionary
+	'''
+	axiom, ruleDictionary = treetype(*TREE_PRESETS[preset])
+	if thicker:
+	    addRule(ruleDictionary, "l", "ll")
+	return axiom, ruleDictionary
+
+def geometryKey(axiom, ruleDictionary, iterations, length, angle, leafscale, leaf, apple, seed):
+	''' the geometry cache key of a tree, a hash of everything its interpreted arrays and scattered leaves and apples depend on
+
+	axiom			: the axiom of the tree
+	ruleDictionary	: the dictionary holding the rules
+	iterations		: the number of iterations
+	length			: step size for growing
+	angle			: the rotation angle for branching
+	leafscale		: a user selected leaf scaling factor
+	leaf			: True when the tree has leaves
+	apple			: True when the tree has apples
+	seed			: the seed of the tree's random streams
+	return			: the hexadecimal SHA-256 key, or None for a tree without a seed, which is never cached
+	'''
+	if seed is None:
+		return None
+	description = [GENERATOR_VERSION, axiom, ruleKey(ruleDictionary), iterations, float(length), float(angle), float(leafscale),
+				   bool(leaf), bool(apple), seed, COLLAPSE_SEGMENTS, LEAF_CELL_SIZE, LEAF_CELL_LIMIT]
+	return hashlib.sha256(json.dumps(description).encode('utf-8')).hexdigest()
+
+@contextlib.contextmanager
+def geometryCacheLock(directory, exclusive):
+	''' hold the lock of the geometry cache for the body of a with statement, shared by readers and exclusive for
+	adding and evicting entries, so no process loads an entry while another deletes it
+
+	directory	: the directory of the cache
+	exclusive	: True to lock out every other process, False to only lock out writers
+	'''
+	if fcntl is None:
+		yield
+		return
+	with open(os.path.join(directory, '.lock'), 'a') as lockFile:
+		fcntl.flock(lockFile, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+		try:
+			yield
+		finally:
+			fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+def loadGeometry(key, directory=None):
+	''' load a tree from the geometry cache, every array memory mapped read only straight from its file
+
+	key			: the key from geometryKey
+	directory	: the directory of the cache, GEOMETRY_CACHE_DIR when None
+	return		: a dictionary with the 'turtle' described in interpretTurtle, the 'leaves' described in cullLeaves or None,
+				  and the 'apples' array or None, or None when the tree is not in the cache
+	'''
+	if key is None:
+		return None
+	directory = directory or GEOMETRY_CACHE_DIR
+	entry = os.path.join(directory, key)
+	if not os.path.isdir(entry):
+		return None
+	geometry = {'turtle': {}, 'leaves': None, 'apples': None}
+	with geometryCacheLock(directory, False):
+		try:
+			for fileName in os.listdir(entry):
+				part, name = os.path.splitext(fileName)[0].split('.')
+				array = np.load(os.path.join(entry, fileName), mmap_mode='r')
+				if part == 'turtle':
+					geometry['turtle'][name] = array
+				elif part == 'leaves':
+					geometry['leaves'] = geometry['leaves'] or {}
+					geometry['leaves'][name] = float(array) if name == 'scale' else array
+				else:
+					geometry['apples'] = array
+			#the entry is touched on every hit, its modification time orders the evictions
+			os.utime(entry, None)
+			return geometry
+		except (OSError, ValueError):
+			pass
+	#an entry cut short by a crash is a miss, it is removed so the next store can replace it
+	try:
+		with geometryCacheLock(directory, True):
+			if os.path.isdir(entry):
+				discardGeometry(directory, key)
+	except OSError:
+		pass
+	return None
+
+def discardGeometry(directory, key):
+	''' delete an entry of the geometry cache, called under the exclusive lock
+
+	The entry is renamed out of the way before it is deleted, so arrays other processes already have mapped stay readable.
+
+	directory	: the directory of the cache
+	key			: the key of the entry
+	'''
+	trash = tempfile.mkdtemp(prefix='.evicted-', dir=directory)
+	os.rename(os.path.join(directory, key), os.path.join(trash, key))
+	shutil.rmtree(trash, ignore_errors=True)
+
+def storeGeometry(key, turtle, leaves=None, apples=None, directory=None, limit=None):
+	''' add a tree to the geometry cache, one .npy file per array, then evict the least recently used trees past the size limit
+
+	The files are written to a temporary directory and renamed into place, so other processes only ever see a whole entry.
+	When two processes store the same tree the first rename wins and the second copy is thrown away.
+
+	key			: the key from geometryKey
+	turtle		: the dictionary returned by interpretTurtle
+	leaves		: the dictionary returned by cullLeaves, or None
+	apples		: the array of apple points from scatterApples, or None
+	directory	: the directory of the cache, GEOMETRY_CACHE_DIR when None
+	limit		: the most bytes the cache holds, GEOMETRY_CACHE_SIZE when None
+	'''
+	if key is None:
+		return
+	directory = directory or GEOMETRY_CACHE_DIR
+	arrays = [('turtle.' + name, array) for name, array in turtle.items()]
+	if leaves is not None:
+		arrays += [('leaves.' + name, np.asarray(array)) for name, array in leaves.items()]
+	if apples is not None:
+		arrays.append(('apples.points', apples))
 	
-	  plength       : the path name of the length control which through querying will be used to set the length of the cyclinders that make up the entire tree structure
-      piterations   : the path name of the iterations control which through querying will be used to set the number of iterations
-      ptreetype     : the path name of the treetype control which through querying will be used to set the axiom and rules for the various treetypes (1-4)
-      prgbs         : the path name of the rgbs control which through querying will be used to set the colour of the trunk and branches
-      pleavesamount : the path name of the leavesamount control which through querying will be used to set the thickness of the leaves,
-                      by specifying the leaf rule (l rule) in the dictionary, e.g l = ll
-      prgbleaves    : the path name of the rgbleaves control which through querying will be used to set the rgb of the leaves
-      papplecheck   : the path name of the applecheck control which through querying will be used to enable or disable fruit/apples in the tree
-      pleafcheck    : the path name of the leafcheck control which through querying will be used to enable or disable leaves in the tree
-      pangle        : the path name of the angle control which through querying will be used to set the starting angle in which brnaches in the tree will be created
-      pleaves       : the path name of the leaves control which through querying will be used to set the type of leaves that will be generated (maple, standard)
-      ptreetype2    : the path name of the treetype2 control which through querying will be used to set the axiom and rules for the 5th 6th and 7th treetypes (5-7)
-      progress      : the path name of the progress control which through querying will be used to increment or set the specific value of the progress bar
-	   
+	temporary = None
+	try:
+		if not os.path.isdir(directory):
+			os.makedirs(directory, exist_ok=True)
+		temporary = tempfile.mkdtemp(prefix='.tmp-', dir=directory)
+		for name, array in arrays:
+			np.save(os.path.join(temporary, name + '.npy'), array)
+		with geometryCacheLock(directory, True):
+			if not os.path.isdir(os.path.join(directory, key)):
+				os.rename(temporary, os.path.join(directory, key))
+			evictGeometry(directory, GEOMETRY_CACHE_SIZE if limit is None else limit)
+	except OSError as error:
+		#the tree is built all the same, it is only not cached
+		cmds.warning("Could not store the tree in the geometry cache: %s" % error)
+	finally:
+		if temporary is not None and os.path.isdir(temporary):
+			shutil.rmtree(temporary, ignore_errors=True)
+
+def evictGeometry(directory, limit):
+	''' delete the least recently used trees of the geometry cache until it holds at most limit bytes, called under the exclusive lock
+
+	directory	: the directory of the cache
+	limit		: the most bytes the cache holds
+	return		: the number of trees evicted
 	'''
+	entries = []
+	for key in os.listdir(directory):
+		entry = os.path.join(directory, key)
+		if key.startswith('.') or not os.path.isdir(entry):
+			continue
+		size = sum(os.path.getsize(os.path.join(entry, fileName)) for fileName in os.listdir(entry))
+		entries.append((os.path.getmtime(entry), size, key))
 	
-	cmds.progressBar(progress, pr = 0,  edit=True)
+	entries.sort()
+	total = sum(size for _, size, _ in entries)
+	evicted = 0
+	for _, size, key in entries:
+		if total <= limit:
+			break
+		discardGeometry(directory, key)
+		total -= size
+		evicted += 1
+	return evicted
+
+def cachedTurtle(axiom, ruleDictionary, iterations, length, angle, leafscale, leaf, apple, seed, progress=None):
+	''' the interpreted tree and its scattered leaves and apples, from the geometry cache when it holds them,
+	otherwise expanded, interpreted and scattered, and stored in the cache when GEOMETRY_CACHE is on
+
+	the arguments are those of geometryKey, and
+	progress	: optional function called with the index of the symbol the turtle has reached, as in interpretTurtle
+	return		: a dictionary with the 'turtle', 'leaves' and 'apples' as returned by loadGeometry, and 'cached', True on a cache hit
+	'''
+	key = geometryKey(axiom, ruleDictionary, iterations, length, angle, leafscale, leaf, apple, seed) if GEOMETRY_CACHE else None
+	geometry = loadGeometry(key)
+	if geometry is not None:
+		geometry['cached'] = True
+		return geometry
+	
+	# past STREAMING_ITERATIONS the symbols are streamed instead of building the whole string in memory,
+	# they are only expanded as the turtle reads them so both are timed as one phase
+	if iterations > STREAMING_ITERATIONS:
+		with profilePhase('expand+interpret'):
+			turtle = interpretTurtle(iterateLazy(axiom, iterations, ruleDictionary), length, angle, progress)
+	else:
+		with profilePhase('expand'):
+			finalString = iterate(axiom, iterations, ruleDictionary)
+		with profilePhase('interpret'):
+			turtle = interpretTurtle(finalString, length, angle, progress)
 	
-	#for the undo tool
-	#saving previous scene before it gets deleted for the next tree generation
-	cmds.file(rename="/home/s5113911/PythonProgramming/Project/previous")
-	saved = cmds.file(save=True, type="mayaAscii")
+	#the leaves and apples each come from fresh streams of the seed, as buildLeaves and buildApples draw them
+	leaves = cullLeaves(scatterLeaves(turtle, leafscale, streams=randomStreams(seed))) if leaf else None
+	apples = scatterApples(turtle, randomStreams(seed)) if apple else None
+	storeGeometry(key, turtle, leaves, apples)
+	return {'turtle': turtle, 'leaves': leaves, 'apples': apples, 'cached': False}
 
-	# clear up the scene
-	cmds.select(all=True)
-	cmds.delete()
+def generateBatchTree(params):
+	''' generate and export one tree of a batch, run inside a worker process of generateBatch
+
+	With GEOMETRY_CACHE on the whole tree is interpreted at once, so it can be stored in or loaded from the geometry cache,
+	with it off the tree is streamed through the exporter chunk by chunk.
+
+	params		: a parameter set as described in generateBatch, with the output 'path' filled in
+	return		: a dictionary with the 'path' written, the 'seed', the 'vertices', the 'expand', 'export' and 'total' times in seconds,
+				  and 'cached', True when the tree came from the geometry cache
+	'''
+	startTime = time.time()
 	
-	modelGroup = []
+	axiom, ruleDictionary = presetRules(params['treetype'], params.get('thicker', False))
+	iterations = params.get('iterations', 4)
+	length = params.get('length', 0.6)
+	angle = params.get('angle', 25)
+	leafscale = params.get('leafscale', 1.2)
+	leaf = params.get('leaf', True)
+	apple = params.get('apple', False)
 	
-	actionString = ""	# the final action string to build the tree
+	finalString = turtle = None
+	cached = False
+	if GEOMETRY_CACHE:
+	    geometry = cachedTurtle(axiom, ruleDictionary, iterations, length, angle, leafscale, leaf, apple, params['seed'])
+	    turtle = geometry['turtle']
+	    cached = geometry['cached']
+	elif iterations > STREAMING_ITERATIONS:
+	    finalString = iterateLazy(axiom, iterations, ruleDictionary)
+	else:
+	    finalString = iterate(axiom, iterations, ruleDictionary)
+	expandTime = time.time()
 	
-	apple = False
-	leaf = False
-	lamount = 0
+	exporter = exportLods if params.get('lods') else exportTree
+	vertices = exporter(params['path'], finalString, length, angle, leafscale, leaf, apple, params.get('colours'), params['seed'], turtle)[0]
+	endTime = time.time()
+	return {'path': params['path'], 'seed': params['seed'], 'vertices': vertices, 'cached': cached,
+	        'expand': expandTime - startTime, 'export': endTime - expandTime, 'total': endTime - startTime}
+
+def generateBatch(paramSets, outputDir, processes=None, fileformat='obj'):
+	''' generate many trees at once across a pool of worker processes, writing each tree to its own file
 
-	axiom, ruleDictionary = treetype(cmds.radioButtonGrp(ptreetype, query=True, select=True), cmds.radioButtonGrp(ptreetype2, query=True, select=True))
+	Each parameter set is a dictionary with a 'treetype' (a name from TREE_PRESETS) and optionally 'iterations' (4), 'angle' (25),
+	'length' (0.6), 'leafscale' (1.2), 'seed' (the index of the set), 'thicker' (False), 'leaf' (True), 'apple' (False),
+	'lods' (False, every level of detail in LOD_SETTINGS in one file), 'colours' and 'name'. The workers only use the exporters, never maya.cmds, so inside Maya run the batch from mayapy.
+
+	The workers find generateBatchTree by the name the generator module is registered under in sys.modules, and the file name
+	has a hyphen so it cannot be imported by name. Run the batch from the command line, which works with any start method:
+	    mayapy FinalTreeGen-MorganMoore.py --batch trees.json outputDir
+	or load the module registered in sys.modules, as TreeGenBenchmark.loadGenerator does, which works where workers are forked.
+
+	paramSets	: the list of parameter sets
+	outputDir	: the directory the trees are written to
+	processes	: the number of worker processes, the number of CPU cores when None
+	fileformat	: 'obj' or 'glb'
+	return		: the list of per tree results from generateBatchTree, in the order of paramSets
+	'''
+	#spawned workers import the module by name, or run the main script again, forked ones copy sys.modules
+	moduleName = generateBatchTree.__module__
+	importable = moduleName == '__main__' or importlib.machinery.PathFinder.find_spec(moduleName) is not None
+	if sys.modules.get(moduleName) is None or (multiprocessing.get_start_method() != 'fork' and not importable):
+	    raise RuntimeError("The batch workers cannot find the generator module '%s'. Run the batch with --batch from the command line, "
+	                       "or register the module in sys.modules when loading it where workers are forked" % moduleName)
+	if not os.path.isdir(outputDir):
+	    os.makedirs(outputDir)
 	
-	material = materialtype(cmds.radioButtonGrp(pmaterialtype, query=True, select=True))
-	leafmaterial = materialtype(cmds.radioButtonGrp(pleafmaterial, query=True, select=True))
+	jobs = []
+	for index, params in enumerate(paramSets):
+	    job = dict(params)
+	    job.setdefault('seed', index)
+	    name = job.get('name', "%s_%04d" % (job['treetype'], index))
+	    job['path'] = os.path.join(outputDir, "%s.%s" % (name, fileformat))
+	    jobs.append(job)
 	
-	leaftype = cmds.radioButtonGrp(pleaves, query=True, select=True)
+	startTime = time.time()
+	pool = multiprocessing.Pool(processes)
+	try:
+	    results = pool.map(generateBatchTree, jobs, chunksize=1)
+	finally:
+	    pool.close()
+	    pool.join()
+	wallTime = time.time() - startTime
 	
-	leavesamount = cmds.radioButtonGrp(pleavesamount, query=True, select=True)
+	for result in results:
+	    print("%-40s seed %-6d %8d vertices  %-6s %.3fs  export %.3fs  total %.3fs" % (os.path.basename(result['path']), result['seed'], result['vertices'],
+	          'cached' if result['cached'] else 'expand', result['expand'], result['export'], result['total']))
+	busyTime = sum(result['total'] for result in results)
+	print("Batch of %d trees took %.3fs, %.3fs of tree time, %.2fx speedup" % (len(results), wallTime, busyTime, busyTime / wallTime if wallTime else 0.0))
+	return results
+
+def forestPositions(area, count, densityMap, stream):
+	''' scatter the trees of a forest over the ground, more of them where the density map is higher
+
+	area		: the (minimum X, minimum Z, maximum X, maximum Z) of the ground
+	count		: the number of trees
+	densityMap	: a 2D array of relative densities laid over the ground, rows along Z and columns along X, or None for an even spread
+	stream		: the numpy.random.Generator to draw from
+	return		: (count, 3) array of positions on the ground plane
+	'''
+	minX, minZ, maxX, maxZ = area
+	if densityMap is None:
+		densityMap = np.ones((1, 1))
+	densityMap = np.asarray(densityMap, dtype=np.float64)
+	rows, columns = densityMap.shape
+	weights = np.clip(densityMap, 0.0, None).ravel()
+	if not weights.sum():
+		raise ValueError("The density map of a forest must have somewhere to put a tree")
 	
+	#a grid cell is picked by its density, then a point inside it
+	cells = stream.choice(len(weights), count, p=weights / weights.sum())
+	offsets = stream.random((count, 2))
+	positions = np.zeros((count, 3))
+	positions[:, 0] = minX + (cells % columns + offsets[:, 0]) * (maxX - minX) / columns
+	positions[:, 2] = minZ + (cells // columns + offsets[:, 1]) * (maxZ - minZ) / rows
+	return positions
+
+def forestPrototype(turtle, params, seed, branches=None):
+	''' build one look of a tree of a forest as a single group, with its leaves and apples baked into meshes
+
+	The leaves and apples are made from LEAF_CARD and APPLE_MESH, as in the exporters, as a particle instancer inside
+	an instanced group would not be drawn.
+
+	turtle		: the dictionary returned by interpretTurtle
+	params		: the tree parameters, as described in buildForest
+	seed		: the seed of the leaves and apples of this look
+	branches	: the branch mesh of another look of the same tree to instance instead of building a new one
+	return		: the name of the group, and the names of its branch, leaf and apple meshes, the last two None when there are none
+	'''
+	streams = randomStreams(seed)
+	if branches is None:
+		branchMesh = createBranchMeshes(turtle)[0]
+	else:
+		branchMesh = cmds.instance(branches)[0]
+	members = [branchMesh]
 	
-	if(cmds.checkBoxGrp(papplecheck, query=True, value1=True)):
-	    cmds.file("/home/s5113911/PythonProgramming/Project/apple.ma", i=True)
-	    #cmds.file("\home\xyang\maya_scripts\submission\models\apple.ma", i = True)
-	    apple = True
-	    
-	if(cmds.checkBoxGrp(pleafcheck, query=True, value1=True)):
-	    if leaftype ==1:
-	        #cmds.file("/home/s5113911/PythonProgramming/Project/leafy1.ma", i=True)
-   	        cmds.file("/home/s5113911/PythonProgramming/Project/leafynomaterial.ma", i=True)
-	       
-	        #cmds.file("\home\xyang\maya_scripts\submission\models\leafy1.ma", i=True)
-	    if leaftype ==2:
-	        cmds.file("/home/s5113911/PythonProgramming/Project/mapleleaf2.ma", i=True)
-	        #cmds.file("\home\xyang\maya_scripts\submission\models\mapleleaf2.ma", i = True)
-	    leaf =True
-	   
-	iterations = cmds.intSliderGrp(piterations, query=True, value=True)
-	stepLength = cmds.floatSliderGrp(plength, query=True, value=True)
+	leafMesh = None
+	if params['leaf']:
+		leaves = cullLeaves(scatterLeaves(turtle, params['leafscale'], streams=streams))
+		if len(leaves['points']):
+			rotations = np.zeros((len(leaves['points']), 3))
+			rotations[:, :2] = leaves['rotations']
+			leafMesh = createMesh(*instanceMesh(LEAF_CARD[0], LEAF_CARD[1], LEAF_CARD[2], leaves['points'], rotations,
+												np.full(len(rotations), leaves['scale'])), name="leaves")
+			members.append(leafMesh)
 	
-	rgb = cmds.colorSliderGrp(prgbs, query=True, rgbValue=True)
-	leavesrgb = cmds.colorSliderGrp(prgbleaves, query=True, rgbValue=True)
-	leafscale = cmds.floatSliderGrp(pleafscale, query=True, value=True)
-	angle = cmds.floatSliderGrp(pangle, query=True, value=True)
+	appleMesh = None
+	if params['apple']:
+		apples = scatterApples(turtle, streams)
+		if len(apples):
+			appleMesh = createMesh(*instanceMesh(APPLE_MESH[0], APPLE_MESH[1], APPLE_MESH[2], apples - [0.0, 0.8, 0.0],
+												 np.zeros((len(apples), 3)), np.full(len(apples), 0.1)), name="apples")
+			members.append(appleMesh)
+	return cmds.group(members, n = "forestTree"), branchMesh, leafMesh, appleMesh
+
+def buildForest(area, count, mix, densityMap=None, params=None, seed=None, variants=FOREST_VARIANTS):
+	''' scatter a forest of trees over the ground, without touching anything already in the scene
+
+	Each tree of the mix is expanded and interpreted once, and built once per look, as a hidden prototype.
+	Every placed tree is a particle of one particle instancer picking its prototype by objectIndexPP, with a random
+	turn, lean and scale, so the time and memory of a forest grow with the number of trees in the mix, not the number placed.
+
+	The tree parameters are a dictionary with optionally 'iterations' (4), 'angle' (25), 'length' (0.6), 'leafscale' (1.2),
+	'thicker' (False), 'leaf' (True), 'apple' (False), 'material' ('lambert'), 'leafmaterial' ('lambert'),
+	'rgb' ((0.3, 0.2, 0.1)) and 'leavesrgb' ((0.1, 0.5, 0.1)).
+
+	area		: the (minimum X, minimum Z, maximum X, maximum Z) of the ground
+	count		: the number of trees
+	mix			: a dictionary of relative weights keyed by a name from TREE_PRESETS, or by a (name, iterations) tuple to
+				  override the number of iterations of that tree
+	densityMap	: a 2D array of relative densities laid over the ground, rows along Z and columns along X, or None for an even spread
+	params		: the tree parameters shared by the whole forest
+	seed		: the integer seed of the forest, or None for a fresh unpredictable forest
+	variants	: the number of looks of each tree, each with its own leaves and apples on the same branches
+	return		: the name of the group holding the forest
+	'''
+	settings = {'iterations': 4, 'angle': 25, 'length': 0.6, 'leafscale': 1.2, 'thicker': False, 'leaf': True, 'apple': False,
+				'material': 'lambert', 'leafmaterial': 'lambert', 'rgb': (0.3, 0.2, 0.1), 'leavesrgb': (0.1, 0.5, 0.1)}
+	settings.update(params or {})
+	trees = [tree if isinstance(tree, tuple) else (tree, settings['iterations']) for tree in mix]
+	weights = np.array(list(mix.values()), dtype=np.float64)
+	streams = randomStreams(seed, FOREST_STREAMS)
 	
-   
-	if leavesamount==2:
+	positions = forestPositions(area, count, densityMap, streams['forestPlace'])
+	chosen = streams['forestTree'].choice(len(trees), count, p=weights / weights.sum())
+	indices = chosen * variants + streams['forestVariant'].integers(0, variants, count)
+	rotations = np.zeros((count, 3))
+	rotations[:, 1] = streams['forestRotation'].uniform(0.0, 360.0, count)
+	rotations[:, [0, 2]] = streams['forestRotation'].uniform(-FOREST_TILT, FOREST_TILT, (count, 2))
+	scales = np.repeat(streams['forestScale'].uniform(FOREST_SCALE[0], FOREST_SCALE[1], count)[:, None], 3, axis=1)
+	
+	#only the looks some tree uses are built, renumbered in the order they are built
+	used, indices = np.unique(indices, return_inverse=True)
+	prototypes = []
+	assignments = collections.OrderedDict()
+	branches = {}
+	for index in used:
+		tree = index // variants
+		preset, iterations = trees[tree]
+		if tree not in branches:
+			axiom, ruleDictionary = presetRules(preset, settings['thicker'])
+			if iterations > STREAMING_ITERATIONS:
+				finalString = iterateLazy(axiom, iterations, ruleDictionary)
+			else:
+				finalString = iterate(axiom, iterations, ruleDictionary)
+			turtle = interpretTurtle(finalString, settings['length'], settings['angle'])
+			branches[tree] = (turtle, None)
+		turtle, firstBranches = branches[tree]
+		lookSeed = None if seed is None else [seed, int(index)]
+		group, branchMesh, leafMesh, appleMesh = forestPrototype(turtle, settings, lookSeed, firstBranches)
+		if firstBranches is None:
+			branches[tree] = (turtle, branchMesh)
+		prototypes.append(group)
+		
+		#every instance of the branches is assigned, a shading group holds the instances of a shape one by one
+		for mesh, material, colour in ((branchMesh, 'material', 'rgb'), (leafMesh, 'leafmaterial', 'leavesrgb'), (appleMesh, 'material', None)):
+			if mesh is not None:
+				shader = getShader(settings[material], settings[colour] if colour else FOREST_APPLE_COLOUR)
+				assignments.setdefault(shader[0], []).append(mesh)
+	
+	for setName, members in assignments.items():
+		cmds.sets(members, edit=True, forceElement=setName)
+	profileCount('forestPrototypes', len(prototypes))
+	profileCount('forestTrees', count)
+	
+	prototypeGroup = cmds.group(prototypes, n = "forestPrototypes", world=True)
+	instances = createInstances(prototypes, positions, rotations, scales, "forest", indices)
+	cmds.hide(prototypeGroup)
+	return cmds.group([prototypeGroup] + instances, n = "forest", world=True)
+	
+def loadTemplate(asset):
+	'''load a template object from its scene file once per session, keeping it hidden in the ASSET_GROUP group
+
+	The file is imported into its own namespace, so templates with the same object name do not clash.
+	Later calls reuse the loaded template, it is only imported again when the file has changed on disk
+	or the template has gone from the scene.
+
+	asset		: one of the (file name, object name, namespace) tuples in LEAF_ASSETS or APPLE_ASSET
+	return		: the name of the template object
+	'''
+	fileName, node, namespace = asset
+	path = os.path.join(ASSET_ROOT, fileName)
+	template = namespace + ':' + node
+	mtime = os.path.getmtime(path) if os.path.exists(path) else None
+	if assetCache.get(namespace) == (path, mtime) and cmds.objExists(template):
+	    return template
+	
+	#the file has changed since it was loaded, so the old copy is removed first
+	if cmds.namespace(exists=namespace):
+	    cmds.namespace(removeNamespace=namespace, deleteNamespaceContent=True)
+	cmds.file(path, i=True, namespace=namespace)
+	if not cmds.objExists(ASSET_GROUP):
+	    cmds.group(empty=True, name=ASSET_GROUP)
+	    cmds.hide(ASSET_GROUP)
+	cmds.parent(template, ASSET_GROUP)
+	assetCache[namespace] = (path, mtime)
+	return template
+
+def clearScene():
+	'''delete everything in the scene ahead of a new tree, except the loaded templates and the pooled shaders
+
+	Selecting everything also selects the shading engines and materials, not only the objects, so every node in the
+	asset namespaces is kept, or the templates would lose their shading, and so are the shader pool's nodes, so they can be reused.
+	'''
+	keep = [ASSET_GROUP]
+	for fileName, node, namespace in list(LEAF_ASSETS.values()) + [APPLE_ASSET]:
+	    if cmds.namespace(exists=namespace):
+	        keep += cmds.ls(namespace + ':*') or []
+	for setName, shaderName in shaderPool.values():
+	    keep += [setName, shaderName]
+	
+	cmds.select(all=True)
+	keep = cmds.ls(keep)
+	if keep:
+	    cmds.select(keep, deselect=True)
+	if cmds.ls(selection=True):
+	    cmds.delete()
+
+def importLeafTemplate(leaftype):
+	'''load the leaf template through the asset cache
+
+	leaftype	: the value of the leaves control, 1 for the default leaf and 2 for the maple leaf
+	return		: the name of the leaf template object
+	'''
+	return loadTemplate(LEAF_ASSETS[leaftype])
+
+def importAppleTemplate():
+	'''load the apple template through the asset cache
+
+	return		: the name of the apple template object
+	'''
+	return loadTemplate(APPLE_ASSET)
+
+def invalidatedStages(previous, params):
+	'''work out which stages of the last build a change of parameters invalidates
+
+	previous	: the parameters of the last build, or None when there is nothing to build on
+	params		: the new parameters
+	return		: a set of the stages to redo, 'geometry' means everything is rebuilt,
+				  otherwise any of 'leaves', 'apples', 'materials' and 'lods'
+	'''
+	if previous is None:
+	    return set(['geometry'])
+	stages = set()
+	for stage, keys in BUILD_STAGES:
+	    if any(previous.get(key) != params.get(key) for key in keys):
+	        stages.add(stage)
+	if 'geometry' in stages:
+	    return set(['geometry'])
+	#new leaves need their material assigning
+	if 'leaves' in stages and params['leaf']:
+	    stages.add('materials')
+	return stages
+
+def treeRules(params):
+	'''the axiom, rules and number of iterations of a tree, with the predicted size of the tree checked against the node budget
+	before anything in the scene is touched
+
+	params		: the parameters read by readParameters
+	return		: the axiom, the ruledictionary and the number of iterations, reduced when AUTO_REDUCE_ITERATIONS allows,
+				  or None when the tree is over the budget and nothing should be built
+	'''
+	axiom, ruleDictionary = treetype(params['treetype'], params['treetype2'])
+	if params['thicker']:
 	    addRule(ruleDictionary, "l", "ll")
-	    lamount = 2
+	iterations = params['iterations']
+	leaf = params['leaf']
+	apple = params['apple']
 	
-	# create the action string
-	finalString=iterate(axiom, iterations, ruleDictionary)
+	fitted = fitNodeBudget(axiom, iterations, ruleDictionary, leaf, apple, NODE_BUDGET)
+	if fitted < iterations:
+	    predicted = predictNodes(predictTree(axiom, iterations, ruleDictionary), leaf, apple)
+	    if fitted == 0 or not AUTO_REDUCE_ITERATIONS:
+	        cmds.warning("Tree would have about %d segments, leaves and apples, over the budget of %d, nothing was built" % (predicted, NODE_BUDGET))
+	        return None
+	    cmds.warning("Tree would have about %d segments, leaves and apples, over the budget of %d, iterations reduced from %d to %d" % (predicted, NODE_BUDGET, iterations, fitted))
+	    iterations = fitted
+	return axiom, ruleDictionary, iterations
+
+class SlicedBuild(object):
+	''' builds a tree a slice at a time from Maya's idle event, so the interface stays responsive and the tree can be watched growing
+
+	The turtle runs as a resumable generator over the streamed action string. Each idle tick it is given SLICE_TIME
+	milliseconds to turn out chunks of segments, and the branches of every chunk are committed to the scene straight away
+	as one mesh. Once the turtle is done the growing branches are swapped for the finished tree by buildTree, which
+	is given the merged turtle so nothing is expanded or interpreted twice.
+	'''
 	
-	# create the 3D model
-	modelGroup = createModel(finalString, stepLength, angle, leafscale, leaf, apple, progress)
+	def __init__(self, params, progress, rules):
+		'''
+		params		: the parameters read by readParameters
+		progress	: the path name to the progress bar control to allow for editing
+		rules		: the axiom, ruledictionary and number of iterations returned by treeRules
+		'''
+		self.params = params
+		self.progress = progress
+		self.job = None
+		self.done = False
+		axiom, ruleDictionary, iterations = rules
+		self.reporter = ProgressReporter(progress, predictTree(axiom, iterations, ruleDictionary)['length'])
+		self.chunks = iterTurtleChunks(iterateLazy(axiom, iterations, ruleDictionary), params['length'], params['angle'],
+									   self.reporter, chunkSize=SLICE_CHUNK_SIZE)
+		self.turtles = []
+		
+		#the tree being replaced goes from the scene now, so it is remembered for undo here rather than by buildTree
+		rememberBuild()
+		lastBuild.clear()
+		clearScene()
+		self.group = cmds.group(empty=True, name="growingTree")
 	
+	def start(self):
+		''' run the build from Maya's idle event, or straight through when there is no Maya to give time back to '''
+		if isHeadless():
+			while not self.done:
+				self.step()
+		else:
+			self.job = cmds.scriptJob(idleEvent=self.step)
 	
-	# set the color to green
-	setMaterial(modelGroup[0], modelGroup[1], material, leafmaterial, rgb ,leavesrgb, progress)
+	def step(self):
+		''' run one time boxed slice of the build, called on every idle tick '''
+		if self.done:
+			return
+		endTime = time.time() + SLICE_TIME / 1000.0
+		try:
+			while time.time() < endTime:
+				turtle = next(self.chunks, None)
+				if turtle is None:
+					self.finish()
+					return
+				self.turtles.append(turtle)
+				meshes = createBranchMeshes(turtle)
+				if meshes:
+					cmds.parent(meshes, self.group)
+			self.reporter.checkCancelled()
+		except BuildCancelled:
+			self.stop()
+			if cmds.objExists(self.group):
+				cmds.delete(self.group)
+			cmds.progressBar(self.progress, pr = 0,  edit=True)
+			cmds.warning("Tree build cancelled")
+		except Exception:
+			self.stop()
+			raise
 	
+	def finish(self):
+		''' swap the growing branches for the finished tree '''
+		self.stop()
+		turtle = mergeTurtles(self.turtles) if self.turtles else packTurtle(self.params['length'], *([[]] * 8))
+		cmds.delete(self.group)
+		buildTree(self.params, self.progress, turtle, remember=False)
 	
-# main program, start with the function buildTree()
+	def stop(self):
+		''' stop the idle job, the build will not step again '''
+		global slicedBuild
+		self.done = True
+		self.reporter.finish()
+		if self.job is not None:
+			#a job cannot safely kill itself from inside its own callback, so it is killed once the callback returns
+			cmds.evalDeferred(functools.partial(cmds.scriptJob, kill=self.job, force=True))
+			self.job = None
+		if slicedBuild is self:
+			slicedBuild = None
+
+def stopSlicedBuild():
+	'''stop the sliced build in progress, if there is one, and remove its growing branches,
+	the tree it was replacing is already on the undo stack
+	'''
+	build = slicedBuild
+	if build is None:
+	    return
+	build.stop()
+	if cmds.objExists(build.group):
+	    cmds.delete(build.group)
+
+def startSlicedBuild(params, progress):
+	'''build a tree a slice at a time while Maya stays responsive, falling back to buildTree when only leaves, apples or materials change
+
+	params		: the parameters read by readParameters
+	progress	: the path name to the progress bar control to allow for editing
+	return		: the SlicedBuild, or None when the tree was built straight away or not at all
+	'''
+	global slicedBuild
+	stopSlicedBuild()
+	groups = lastBuild.get('groups', {})
+	if lastBuild and all(cmds.objExists(group) for group in groups.values()) and 'geometry' not in invalidatedStages(lastBuild['params'], params):
+	    buildTree(params, progress)
+	    return None
+	rules = treeRules(params)
+	if rules is None:
+	    return None
+	build = SlicedBuild(params, progress, rules)
+	slicedBuild = build
+	build.start()
+	return build
+
+def buildTree(params, progress, turtle=None, remember=True):
+	'''build the tree described by a set of parameters, only redoing the stages the change from the last build invalidates
+
+	The leaves and apples are drawn from the random streams of params['seed'], so the same parameters always give the same tree.
+
+	params		: the parameters read by readParameters
+	progress	: the path name to the progress bar control to allow for editing
+	turtle		: the interpreted tree of these parameters when it is already known, e.g. from an undo record, to skip expansion
+	remember	: when True the tree being replaced is pushed onto the undo stack
+	'''
+	cmds.progressBar(progress, pr = 0,  edit=True)
+	
+	rules = treeRules(params)
+	if rules is None:
+	    return
+	axiom, ruleDictionary, iterations = rules
+	leaf = params['leaf']
+	apple = params['apple']
+	
+	#a stage can only be redone on its own while the groups of the last build are still in the scene,
+	#they are copied so a cancelled build leaves the last build as it was
+	groups = dict(lastBuild.get('groups', {}))
+	if any(not cmds.objExists(group) for group in groups.values()):
+	    stages = set(['geometry'])
+	else:
+	    stages = invalidatedStages(lastBuild.get('params'), params)
+	if not stages:
+	    cmds.progressBar(progress, pr = PROGRESS_MAX,  edit=True)
+	    return
+	
+	profiler = None
+	if PROFILE_BUILDS:
+	    profiler = BuildProfiler(params)
+	    profiler.start()
+	symbols = predictTree(axiom, iterations, ruleDictionary)['length']
+	profileCount('symbols', symbols)
+	reporter = ProgressReporter(progress, symbols)
+	sceneChanged = False
+	#the leaves and apples scattered along with the turtle, from the geometry cache or stored in it
+	scattered = {}
+	try:
+	    if 'geometry' not in stages:
+	        turtle = lastBuild['turtle']
+	    elif turtle is None:
+	        # load the tree from the geometry cache or create and interpret the action string,
+	        # nothing in the scene has been touched yet so cancelling here leaves the old tree as it was
+	        scattered = cachedTurtle(axiom, ruleDictionary, iterations, params['length'], params['angle'], params['leafscale'],
+	                                 leaf, apple, params['seed'], reporter)
+	        turtle = scattered['turtle']
+	        profileCount('cached', int(scattered['cached']))
+	    profileCount('cylinders', len(turtle['starts']))
+	    reporter.checkCancelled()
+	    
+	    #the top level nodes already in the scene, anything else is removed if the build is cancelled from here on
+	    sceneBefore = set(cmds.ls(assemblies=True) or [])
+	    sceneChanged = True
+	    
+	    if 'geometry' in stages:
+	        if remember:
+	            rememberBuild()
+	        # clear up the scene
+	        with profilePhase('clear'):
+	            clearScene()
+	        groups = {}
+	        
+	        with profilePhase('branches'):
+	            groups['tree'] = buildBranches(turtle)
+	    reporter.checkCancelled()
+	    
+	    #the groups being replaced are only deleted once their replacements are built,
+	    #so cancelling a change of leaves or apples leaves the whole of the old tree in the scene
+	    replaced = []
+	    if 'geometry' in stages or 'apples' in stages:
+	        if 'apples' in groups:
+	            replaced.append(groups.pop('apples'))
+	        if apple:
+	            with profilePhase('assets'):
+	                appleTemplate = importAppleTemplate()
+	            with profilePhase('apples'):
+	                groups['apples'] = buildApples(turtle, randomStreams(params['seed']), appleTemplate, scattered.get('apples'))
+	    reporter.phase(0.7)
+	    reporter.checkCancelled()
+	    
+	    if 'geometry' in stages or 'leaves' in stages:
+	        if 'leaves' in groups:
+	            replaced.append(groups.pop('leaves'))
+	        if leaf:
+	            with profilePhase('assets'):
+	                leafTemplate = importLeafTemplate(params['leaftype'])
+	            with profilePhase('leaves'):
+	                groups['leaves'] = buildLeaves(turtle, params['leafscale'], randomStreams(params['seed']), leafTemplate, scattered.get('leaves'))
+	    reporter.checkCancelled()
+	    
+	    #the lower levels of detail reuse the turtle rather than expanding it again, they are only rebuilt
+	    #when their branches, leaves or apples change, a change of materials only reassigns them
+	    lodMembers = lastBuild.get('lodMembers')
+	    rebuildLods = bool(stages & set(['geometry', 'leaves', 'apples', 'lods']))
+	    if rebuildLods:
+	        if 'lods' in groups:
+	            replaced.append(groups.pop('lods'))
+	        lodMembers = None
+	        if params.get('lods'):
+	            with profilePhase('lods'):
+	                groups['lods'], lodMembers = buildLods(turtle, params, progress)
+	    reporter.checkCancelled()
+	    
+	    #everything that could be cancelled is built, so the old tree is now replaced
+	    if 'geometry' not in stages and remember:
+	        rememberBuild()
+	    if replaced:
+	        cmds.delete(replaced)
+	    
+	    if 'geometry' in stages or 'materials' in stages:
+	        # set the color to green
+	        #instanced leaves are drawn with the material of their template, so it is given the leaf material too
+	        leafObjects = "noleaves"
+	        if 'leaves' in groups:
+	            leafObjects = [groups['leaves'], importLeafTemplate(params['leaftype'])]
+	        with profilePhase('materials'):
+	            setMaterial(groups['tree'], leafObjects, params['material'], params['leafmaterial'], params['rgb'], params['leavesrgb'], progress)
+	            if 'lods' in groups and not rebuildLods:
+	                lodBranches, lodCards = lodMembers
+	                setMaterial(lodBranches, lodCards or "noleaves", params['material'], params['leafmaterial'], params['rgb'], params['leavesrgb'], progress)
+	except BuildCancelled:
+	    if sceneChanged:
+	        #remove whatever this build added, keeping any templates it loaded
+	        leftovers = [node for node in cmds.ls(assemblies=True) or [] if node not in sceneBefore and node != ASSET_GROUP]
+	        if leftovers:
+	            cmds.delete(leftovers)
+	        #a cleared scene is brought back with undo, otherwise the old tree is still whole and stays the last build
+	        if 'geometry' in stages:
+	            lastBuild.clear()
+	    cmds.progressBar(progress, pr = 0,  edit=True)
+	    cmds.warning("Tree build cancelled")
+	    return
+	finally:
+	    reporter.finish()
+	    if profiler is not None:
+	        profiler.stop()
+	        profiler.printReport()
+	        if PROFILE_REPORT_PATH:
+	            writeProfile(profiler.report(), PROFILE_REPORT_PATH)
+	cmds.progressBar(progress, pr = PROGRESS_MAX,  edit=True)
+	
+	#remember what was built, so the next build can reuse it and it can be exported directly
+	lastBuild.clear()
+	lastBuild.update(params=params, axiom=axiom, rules=ruleDictionary, iterations=iterations, turtle=turtle, groups=groups, lodMembers=lodMembers)
+
+def readParameters(plength, piterations, ptreetype, pmaterialtype, prgbs, pleafscale, pleavesamount, prgbleaves, papplecheck, pleafcheck, pangle, pleaves, ptreetype2, pleafmaterial, pseed, plods):
+	'''query the user interface controls and gather their values into a dictionary of build parameters
+
+	the arguments are the path names of the controls, as described in treegen
+	return		: the dictionary of parameters used by buildTree
+	'''
+	return {'treetype': cmds.radioButtonGrp(ptreetype, query=True, select=True),
+	        'treetype2': cmds.radioButtonGrp(ptreetype2, query=True, select=True),
+	        'iterations': cmds.intSliderGrp(piterations, query=True, value=True),
+	        'length': cmds.floatSliderGrp(plength, query=True, value=True),
+	        'angle': cmds.floatSliderGrp(pangle, query=True, value=True),
+	        'thicker': cmds.radioButtonGrp(pleavesamount, query=True, select=True) == 2,
+	        'leaf': cmds.checkBoxGrp(pleafcheck, query=True, value1=True),
+	        'leaftype': cmds.radioButtonGrp(pleaves, query=True, select=True),
+	        'leafscale': cmds.floatSliderGrp(pleafscale, query=True, value=True),
+	        'apple': cmds.checkBoxGrp(papplecheck, query=True, value1=True),
+	        'material': materialtype(cmds.radioButtonGrp(pmaterialtype, query=True, select=True)),
+	        'leafmaterial': materialtype(cmds.radioButtonGrp(pleafmaterial, query=True, select=True)),
+	        'rgb': tuple(cmds.colorSliderGrp(prgbs, query=True, rgbValue=True)),
+	        'leavesrgb': tuple(cmds.colorSliderGrp(prgbleaves, query=True, rgbValue=True)),
+	        'seed': cmds.intFieldGrp(pseed, query=True, value1=True),
+	        'lods': cmds.checkBoxGrp(plods, query=True, value1=True)}
+
+def treegen( plength, piterations, ptreetype, pmaterialtype, prgbs, pleafscale, pleavesamount, prgbleaves, papplecheck, pleafcheck, pangle, pleaves, ptreetype2, progress, pleafmaterial, pseed, plods, *pArgs):
+	'''using the user inputs from createUI to set the variable that will define the characteristics of the tree
+	
+	  plength       : the path name of the length control which through querying will be used to set the length of the cyclinders that make up the entire tree structure
+      piterations   : the path name of the iterations control which through querying will be used to set the number of iterations
+      ptreetype     : the path name of the treetype control which through querying will be used to set the axiom and rules for the various treetypes (1-4)
+      prgbs         : the path name of the rgbs control which through querying will be used to set the colour of the trunk and branches
+      pleavesamount : the path name of the leavesamount control which through querying will be used to set the thickness of the leaves,
+                      by specifying the leaf rule (l rule) in the dictionary, e.g l = ll
+      prgbleaves    : the path name of the rgbleaves control which through querying will be used to set the rgb of the leaves
+      papplecheck   : the path name of the applecheck control which through querying will be used to enable or disable fruit/apples in the tree
+      pleafcheck    : the path name of the leafcheck control which through querying will be used to enable or disable leaves in the tree
+      pangle        : the path name of the angle control which through querying will be used to set the starting angle in which brnaches in the tree will be created
+      pleaves       : the path name of the leaves control which through querying will be used to set the type of leaves that will be generated (maple, standard)
+      ptreetype2    : the path name of the treetype2 control which through querying will be used to set the axiom and rules for the 5th 6th and 7th treetypes (5-7)
+      progress      : the path name of the progress control which through querying will be used to increment or set the specific value of the progress bar
+      pseed         : the path name of the seed control which through querying will be used to seed the random placement of the leaves and apples
+      plods         : the path name of the LOD control which through querying will be used to also build the lower levels of detail of the tree
+	   
+	'''
+	
+	params = readParameters(plength, piterations, ptreetype, pmaterialtype, prgbs, pleafscale, pleavesamount, prgbleaves, papplecheck, pleafcheck, pangle, pleaves, ptreetype2, pleafmaterial, pseed, plods)
+	if SLICED_BUILD:
+	    startSlicedBuild(params, progress)
+	else:
+	    buildTree(params, progress)
+	
+	
+def batchMain(argv):
+	''' generate a batch of trees from the command line, from a JSON file holding the list of parameter sets described in generateBatch
+
+	argv		: the command line arguments after the script name
+	return		: the exit status
+	'''
+	parser = argparse.ArgumentParser(description="Generate a batch of L-System trees without Maya's scene")
+	parser.add_argument('--batch', required=True, metavar='PARAMS', help="a JSON file holding the list of parameter sets")
+	parser.add_argument('outputDir', help="the directory the trees are written to")
+	parser.add_argument('--processes', type=int, help="the number of worker processes, the number of CPU cores by default")
+	parser.add_argument('--format', default='obj', choices=('obj', 'glb'), help="the file format of the trees")
+	args = parser.parse_args(argv)
+	
+	with open(args.batch) as paramFile:
+	    paramSets = json.load(paramFile)
+	#mayapy can import maya.cmds without a scene to run it in, the batch never needs one
+	setCommandBackend(RecordingCmds())
+	generateBatch(paramSets, args.outputDir, args.processes, args.format)
+	return 0
+
+# main program, start with the function buildTree(), or generate a batch of trees with --batch
 if __name__ == "__main__":
+	if '--batch' in sys.argv[1:]:
+	    sys.exit(batchMain(sys.argv[1:]))
 	createUI('TreeGen', treegen)
\ No newline at end of file
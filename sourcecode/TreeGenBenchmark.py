@@ -0,0 +1,606 @@
+''' L-System Generator Benchmark
+
+    Times the tree generator headless, outside Maya, so its performance can be followed on any machine.
+
+    Every tree preset of the user interface, Curved2 being the default 'H' tree the treetype function falls back to, is run
+    with and without the Thicker (l = ll) rule at each number of iterations. Each run is split into three phases:
+    expansion of the l-system string, interpretation of the string by the turtle, and building of the branches,
+    leaves and apples, with the scene commands sent to a RecordingCmds stand-in for maya.cmds.
+    For each phase the wall time, the peak Python memory and the throughput in symbols or segments per second are reported.
+
+    The results can be saved as a baseline JSON file and later runs compared against it, phases that got slower
+    than the tolerance allows are reported as regressions and make the benchmark exit with status 1.
+
+    With --verify nothing is timed, instead the headless checks in VERIFY_CHECKS are run and any failure makes
+    the benchmark exit with status 1. Among them the opcode turtle is compared against referenceTurtleChunks,
+    a port of the original symbol by symbol turtle, so changes to runOpcodes stay checked.
+
+    Usage:
+        python TreeGenBenchmark.py --save-baseline baseline.json
+        python TreeGenBenchmark.py --baseline baseline.json --iterations 1 6
+        python TreeGenBenchmark.py --verify
+  '''
+import argparse
+import contextlib
+import gc
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+#the generator file is not an importable module name, so it is loaded from its path
+GENERATOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FinalTreeGen-MorganMoore.py')
+
+#the phases of a tree that are timed, in the order they run
+PHASES = ('expand', 'interpret', 'geometry')
+
+def loadGenerator(path=GENERATOR_PATH):
+	''' load the tree generator module from its file, registered in sys.modules as 'treegen'
+	so the worker processes of generateBatch can find its functions
+
+	path		: the path of the generator file
+	return		: the loaded module
+	'''
+	spec = importlib.util.spec_from_file_location('treegen', path)
+	treegen = importlib.util.module_from_spec(spec)
+	sys.modules[spec.name] = treegen
+	spec.loader.exec_module(treegen)
+	return treegen
+
+def benchmarkPresets(treegen):
+	''' the presets to benchmark, the user interface presets, which already include the default 'H' tree as Curved2
+
+	treegen		: the loaded generator module
+	return		: a list of (name, treetype value, treetype2 value) tuples
+	'''
+	return [(name, cv, cv2) for name, (cv, cv2) in treegen.TREE_PRESETS.items()]
+
+def measure(function, traceMemory=False):
+	''' run a function once, timing it or following the peak Python memory it allocates
+
+	Memory tracing slows Python down a lot, so times and memory are measured in separate runs.
+
+	function	: the function to run, called with no arguments
+	traceMemory	: when True the peak memory is measured instead of the time
+	return		: the result of the function and the time in seconds, or the peak memory in bytes when traceMemory is True
+	'''
+	gc.collect()
+	if traceMemory:
+	    tracemalloc.start()
+	    result = function()
+	    peak = tracemalloc.get_traced_memory()[1]
+	    tracemalloc.stop()
+	    return result, peak
+	startTime = time.perf_counter()
+	result = function()
+	return result, time.perf_counter() - startTime
+
+def benchmarkTree(treegen, cv, cv2, thicker, iterations, repeat):
+	''' benchmark the three phases of one tree, keeping the fastest of several repeats
+
+	The expansion cache is emptied before every expansion so each repeat really expands the string.
+	After the timed repeats every phase is run once more with memory tracing.
+
+	treegen		: the loaded generator module
+	cv			: the treetype value of the preset
+	cv2			: the treetype2 value of the preset
+	thicker		: when True the l = ll rule is added
+	iterations	: the number of iterations
+	repeat		: the number of timed runs of each phase
+	return		: a dictionary with the 'symbols', 'segments' and 'commands' of the tree, and the 'seconds', 'memory' and 'throughput' of each phase
+	'''
+	axiom, ruleDictionary = treegen.treetype(cv, cv2)
+	if thicker:
+	    treegen.addRule(ruleDictionary, "l", "ll")
+
+	def expand():
+	    treegen.expansionCache.clear()
+	    return treegen.iterate(axiom, iterations, ruleDictionary)
+
+	def interpret():
+	    return treegen.interpretTurtle(finalString, 1.0, 25.0)
+
+	def geometry():
+	    recorder = treegen.RecordingCmds()
+	    previousBackend = treegen.setCommandBackend(recorder)
+	    try:
+	        treegen.buildBranches(turtle)
+	        treegen.buildLeaves(turtle, 1.2, treegen.randomStreams(0))
+	        treegen.buildApples(turtle, treegen.randomStreams(0))
+	    finally:
+	        treegen.setCommandBackend(previousBackend)
+	    return recorder
+
+	results = {'seconds': {'expand': float('inf'), 'interpret': float('inf'), 'geometry': float('inf')}, 'memory': {}, 'throughput': {}}
+	for _ in range(repeat):
+	    finalString, seconds = measure(expand)
+	    results['seconds']['expand'] = min(results['seconds']['expand'], seconds)
+	    turtle, seconds = measure(interpret)
+	    results['seconds']['interpret'] = min(results['seconds']['interpret'], seconds)
+	    recorder, seconds = measure(geometry)
+	    results['seconds']['geometry'] = min(results['seconds']['geometry'], seconds)
+
+	for phase, function in (('expand', expand), ('interpret', interpret), ('geometry', geometry)):
+	    results['memory'][phase] = measure(function, traceMemory=True)[1]
+
+	results['symbols'] = len(finalString)
+	results['segments'] = len(turtle['starts'])
+	results['commands'] = recorder.count()
+	results['throughput']['expand'] = results['symbols'] / max(results['seconds']['expand'], 1e-9)
+	results['throughput']['interpret'] = results['symbols'] / max(results['seconds']['interpret'], 1e-9)
+	results['throughput']['geometry'] = results['segments'] / max(results['seconds']['geometry'], 1e-9)
+	return results
+
+def runBenchmark(treegen, iterationRange, repeat):
+	''' benchmark every preset with and without the Thicker rule over a range of iterations, printing each tree as it finishes
+
+	treegen			: the loaded generator module
+	iterationRange	: the (first, last) number of iterations, both included
+	repeat			: the number of times each phase is run
+	return			: a dictionary of results keyed by 'preset/thicker/iterations'
+	'''
+	results = {}
+	print("%-24s %9s %8s %8s | %9s %9s %9s | %10s %10s %10s | %8s" % ('tree', 'symbols', 'segments', 'commands', 'expand', 'interpret', 'geometry',
+	                                                              'sym/s exp', 'sym/s int', 'seg/s geo', 'peak MB'))
+	for name, cv, cv2 in benchmarkPresets(treegen):
+	    for thicker in (False, True):
+	        for iterations in range(iterationRange[0], iterationRange[1] + 1):
+	            key = "%s/%s/%d" % (name, 'thicker' if thicker else 'thin', iterations)
+	            result = benchmarkTree(treegen, cv, cv2, thicker, iterations, repeat)
+	            results[key] = result
+	            seconds = result['seconds']
+	            throughput = result['throughput']
+	            print("%-24s %9d %8d %8d | %8.4fs %8.4fs %8.4fs | %10.0f %10.0f %10.0f | %8.2f" % (key, result['symbols'], result['segments'], result['commands'],
+	                  seconds['expand'], seconds['interpret'], seconds['geometry'],
+	                  throughput['expand'], throughput['interpret'], throughput['geometry'], max(result['memory'].values()) / 1048576.0))
+	return results
+
+#the parameters of the trees built by the checks, as read by readParameters
+VERIFY_PARAMS = {'treetype': 1, 'treetype2': 0, 'iterations': 5, 'length': 0.6, 'angle': 25.0, 'thicker': False, 'leaf': True,
+                 'leaftype': 1, 'leafscale': 1.2, 'seed': 1, 'apple': True, 'material': 'lambert', 'leafmaterial': 'lambert',
+                 'rgb': (0.3, 0.2, 0.1), 'leavesrgb': (0.1, 0.5, 0.1), 'lods': False}
+
+def verifyUndoAfterCancel(treegen):
+	''' build two trees, cancel a third part way through its branches, then undo and redo
+
+	treegen		: the loaded generator module
+	return		: the list of failure messages
+	'''
+	failures = []
+	first = dict(VERIFY_PARAMS)
+	second = dict(VERIFY_PARAMS, seed=2)
+	treegen.buildTree(first, 'progress')
+	treegen.buildTree(second, 'progress')
+	
+	buildBranches = treegen.buildBranches
+	def cancellingBranches(turtle):
+	    groupName = buildBranches(turtle)
+	    treegen.cancelBuild()
+	    return groupName
+	treegen.buildBranches = cancellingBranches
+	try:
+	    treegen.buildTree(dict(VERIFY_PARAMS, iterations=4), 'progress')
+	finally:
+	    treegen.buildBranches = buildBranches
+	if treegen.lastBuild:
+	    failures.append("a cancelled build left a last build behind")
+	
+	treegen.previous('progress')
+	if treegen.lastBuild.get('params') != second:
+	    failures.append("undo after a cancelled build did not bring back the replaced tree")
+	treegen.previous('progress')
+	treegen.redo('progress')
+	if treegen.lastBuild.get('params') != second:
+	    failures.append("redo after undoing past a cancelled build did not bring back the tree")
+	return failures
+
+def verifyCancelledLeaves(treegen):
+	''' build a tree, then cancel a change of its leaves once the new leaves are built, and check the old tree is left whole
+
+	treegen		: the loaded generator module
+	return		: the list of failure messages
+	'''
+	failures = []
+	first = dict(VERIFY_PARAMS)
+	treegen.buildTree(first, 'progress')
+	groups = dict(treegen.lastBuild['groups'])
+	
+	buildLeaves = treegen.buildLeaves
+	def cancellingLeaves(*args):
+	    groupName = buildLeaves(*args)
+	    treegen.cancelBuild()
+	    return groupName
+	treegen.buildLeaves = cancellingLeaves
+	calls = len(treegen.cmds.calls)
+	try:
+	    treegen.buildTree(dict(first, seed=2), 'progress')
+	finally:
+	    treegen.buildLeaves = buildLeaves
+	#the recording backend keeps no scene, so the deleted nodes are read from the delete commands
+	deleted = set()
+	for command, args, kwargs in treegen.cmds.calls[calls:]:
+	    if command == 'delete':
+	        for arg in args:
+	            deleted.update(arg if isinstance(arg, list) else [arg])
+	missing = [group for group in groups.values() if group in deleted]
+	if missing:
+	    failures.append("the cancelled change of leaves deleted %s" % ', '.join(missing))
+	if treegen.lastBuild.get('params') != first or treegen.lastBuild.get('groups') != groups:
+	    failures.append("the cancelled change of leaves did not leave the old tree as the last build")
+	if treegen.undoStack:
+	    failures.append("the cancelled change of leaves was remembered for undo")
+	return failures
+
+def verifyHistorySnapshots(treegen):
+	''' build more trees than UNDO_SNAPSHOTS, undo them all and check neither history keeps more turtles than that
+
+	treegen		: the loaded generator module
+	return		: the list of failure messages
+	'''
+	failures = []
+	trees = treegen.UNDO_SNAPSHOTS + 3
+	for seed in range(trees):
+	    treegen.buildTree(dict(VERIFY_PARAMS, iterations=3, seed=seed), 'progress')
+	for seed in range(trees - 1):
+	    treegen.previous('progress')
+	for name in ('undoStack', 'redoStack'):
+	    snapshots = sum(record['turtle'] is not None for record in getattr(treegen, name))
+	    if snapshots > treegen.UNDO_SNAPSHOTS:
+	        failures.append("the %s holds %d turtles, over the %d of UNDO_SNAPSHOTS" % (name, snapshots, treegen.UNDO_SNAPSHOTS))
+	if len(treegen.redoStack) != trees - 1:
+	    failures.append("the redo stack holds %d records rather than %d" % (len(treegen.redoStack), trees - 1))
+	return failures
+
+def verifyMaterialMembers(treegen):
+	''' build a tree with its levels of detail and check every material assignment is given a flat list of object names
+
+	treegen		: the loaded generator module
+	return		: the list of failure messages
+	'''
+	treegen.buildTree(dict(VERIFY_PARAMS, lods=True), 'progress')
+	failures = []
+	for command, args, kwargs in treegen.cmds.calls:
+	    if command == 'sets' and 'forceElement' in kwargs:
+	        members = args[0] if isinstance(args[0], list) else [args[0]]
+	        if not all(isinstance(member, str) for member in members):
+	            failures.append("%s was given %r" % (kwargs['forceElement'], args[0]))
+	return failures
+
+def verifyUndoDuringSlicedBuild(treegen):
+	''' start a sliced build over a tree, run one slice of it, then undo and redo
+
+	Headless a sliced build runs straight through, so it is stepped by hand here as Maya's idle event would.
+
+	treegen		: the loaded generator module
+	return		: the list of failure messages
+	'''
+	failures = []
+	first = dict(VERIFY_PARAMS)
+	treegen.buildTree(first, 'progress')
+	second = dict(VERIFY_PARAMS, iterations=7)
+	build = treegen.SlicedBuild(second, 'progress', treegen.treeRules(second))
+	treegen.slicedBuild = build
+	build.step()
+	if build.done or not build.turtles:
+	    failures.append("the first slice of the sliced build did not grow part of the tree")
+	
+	treegen.previous('progress')
+	if not build.done or treegen.slicedBuild is not None:
+	    failures.append("undo did not stop the sliced build")
+	if treegen.lastBuild.get('params') != first:
+	    failures.append("undo during a sliced build did not bring back the replaced tree")
+	treegen.redo('progress')
+	if treegen.redoStack or treegen.lastBuild.get('params') != first:
+	    failures.append("redo after stopping a sliced build changed the tree")
+	
+	build = treegen.SlicedBuild(second, 'progress', treegen.treeRules(second))
+	treegen.slicedBuild = build
+	build.step()
+	treegen.cancelBuild()
+	build.step()
+	treegen.previous('progress')
+	if treegen.lastBuild.get('params') != first:
+	    failures.append("undo after cancelling a sliced build did not bring back the replaced tree")
+	return failures
+
+def referenceTurtleChunks(treegen, actionString, length, turn, collapse, chunkSize):
+	''' the original turtle, one symbol at a time with a Python stack, kept as the reference runOpcodes is checked against
+
+	treegen		: the loaded generator module
+	the other arguments are those of iterTurtleChunks
+	return		: a generator of dictionaries of arrays, as from iterTurtleChunks
+	'''
+	angleX = 0
+	angleZ = 0
+	x, y, z = 0.0, 0.0, 0.0
+	direction = treegen.calculateVector(1.0, angleZ, angleX)
+	turned = False
+	extendable = False
+	stack = []
+	level = 1
+	
+	lists = ([], [], [], [], [], [], [], [])
+	starts, directions, lengths, levels, leafPoints, leafLevels, applePoints, appleLevels = lists
+	
+	for symbol in actionString:
+	    if symbol == 'F' or symbol == 'J':
+	        if turned:
+	            direction = treegen.calculateVector(1.0, angleZ, angleX)
+	            turned = False
+	        if extendable:
+	            lengths[-1] += length
+	        else:
+	            if chunkSize and len(starts) >= chunkSize:
+	                yield treegen.packTurtle(length, *lists)
+	                lists = ([], [], [], [], [], [], [], [])
+	                starts, directions, lengths, levels, leafPoints, leafLevels, applePoints, appleLevels = lists
+	            starts.append((x, y, z))
+	            directions.append(direction)
+	            lengths.append(length)
+	            levels.append(level)
+	            extendable = collapse
+	        x += length*direction[0]
+	        y += length*direction[1]
+	        z += length*direction[2]
+	    elif symbol == 'l':
+	        leafPoints.append((x, y, z))
+	        leafLevels.append(level)
+	        extendable = False
+	    elif symbol == 'a':
+	        applePoints.append((x, y, z))
+	        appleLevels.append(level)
+	        extendable = False
+	    elif symbol in '-+/|':
+	        if symbol in '-+':
+	            angleZ += turn if symbol == '+' else -turn
+	        else:
+	            angleX += turn if symbol == '|' else -turn
+	        turned = True
+	        extendable = False
+	    elif symbol == '[':
+	        stack.append((x, y, z, angleZ, angleX, direction, turned))
+	        level += 1
+	        extendable = False
+	    elif symbol == ']':
+	        x, y, z, angleZ, angleX, direction, turned = stack.pop()
+	        level -= 1
+	        extendable = False
+	
+	yield treegen.packTurtle(length, *lists)
+
+def verifyTurtle(treegen):
+	''' check the opcode turtle against referenceTurtleChunks on every preset, with and without collapsing,
+	for several opcode block sizes, whole and streamed action strings, and in chunks
+
+	treegen		: the loaded generator module
+	return		: the list of failure messages
+	'''
+	import numpy as np
+	failures = []
+	opcodeBlock = treegen.OPCODE_BLOCK
+	try:
+	    for name, cv, cv2 in benchmarkPresets(treegen):
+	        for thicker in (False, True):
+	            axiom, ruleDictionary = treegen.treetype(cv, cv2)
+	            if thicker:
+	                treegen.addRule(ruleDictionary, "l", "ll")
+	            #the smallest blocks are slow, so they are run on smaller trees
+	            for block, iterations in ((7, 4), (64, 5), (opcodeBlock, 7)):
+	                treegen.OPCODE_BLOCK = block
+	                finalString = treegen.iterate(axiom, iterations, ruleDictionary)
+	                for collapse in (True, False):
+	                    for streamed, chunkSize in ((False, 0), (True, 0), (True, 100)):
+	                        actionString = treegen.iterateLazy(axiom, iterations, ruleDictionary) if streamed else finalString
+	                        chunks = list(treegen.iterTurtleChunks(actionString, 0.6, 25.0, collapse=collapse, chunkSize=chunkSize))
+	                        reference = list(referenceTurtleChunks(treegen, finalString, 0.6, 25.0, collapse, chunkSize))
+	                        same = len(chunks) == len(reference) and all(chunk[key].shape == expected[key].shape and np.allclose(chunk[key], expected[key])
+	                                                                      for chunk, expected in zip(chunks, reference) for key in expected)
+	                        if not same:
+	                            failures.append("%s %s, %d iterations, block %d, collapse %s, %s, chunks of %d differ from the reference"
+	                                            % (name, 'thicker' if thicker else 'thin', iterations, block, collapse,
+	                                               'streamed' if streamed else 'whole', chunkSize))
+	finally:
+	    treegen.OPCODE_BLOCK = opcodeBlock
+	return failures
+
+@contextlib.contextmanager
+def temporaryCache(treegen):
+	''' turn the geometry cache on in a fresh temporary directory for the body of a with statement, removing it afterwards
+
+	treegen		: the loaded generator module
+	return		: the path of the cache directory, from the with statement
+	'''
+	settings = treegen.GEOMETRY_CACHE, treegen.GEOMETRY_CACHE_DIR
+	directory = tempfile.mkdtemp(prefix='treegen-cache-')
+	treegen.GEOMETRY_CACHE, treegen.GEOMETRY_CACHE_DIR = True, directory
+	try:
+	    yield directory
+	finally:
+	    treegen.GEOMETRY_CACHE, treegen.GEOMETRY_CACHE_DIR = settings
+	    shutil.rmtree(directory, ignore_errors=True)
+
+def sameArrays(first, second):
+	''' whether two dictionaries of arrays, as in the turtle or leaves of a tree, hold the same arrays
+
+	first		: a dictionary of arrays, or None
+	second		: a dictionary of arrays, or None
+	return		: True when both are None or they have the same keys and equal arrays
+	'''
+	import numpy as np
+	if first is None or second is None:
+	    return first is second
+	return sorted(first) == sorted(second) and all(np.array_equal(first[key], second[key]) for key in first)
+
+def verifyCacheHit(treegen):
+	''' store a tree in an empty geometry cache and check the next build of it is a hit giving the same arrays
+
+	treegen		: the loaded generator module
+	return		: the list of failure messages
+	'''
+	failures = []
+	axiom, ruleDictionary = treegen.presetRules('Standard')
+	tree = (axiom, ruleDictionary, 5, 0.6, 25.0, 1.2, True, True, 1)
+	with temporaryCache(treegen) as directory:
+	    stored = treegen.cachedTurtle(*tree)
+	    loaded = treegen.cachedTurtle(*tree)
+	    if stored['cached'] or not loaded['cached']:
+	        failures.append("the first build was %s and the second %s" % tuple('a hit' if geometry['cached'] else 'a miss' for geometry in (stored, loaded)))
+	    for part in ('turtle', 'leaves'):
+	        if not sameArrays(stored[part], loaded[part]):
+	            failures.append("the %s loaded from the cache differ from the stored ones" % part)
+	    if not sameArrays({'points': stored['apples']}, {'points': loaded['apples']}):
+	        failures.append("the apples loaded from the cache differ from the stored ones")
+	    #the temporary directories of the atomic rename never outlive a store
+	    leftovers = [name for name in os.listdir(directory) if name.startswith('.tmp-') or name.startswith('.evicted-')]
+	    if leftovers:
+	        failures.append("the store left %s behind" % ', '.join(leftovers))
+	return failures
+
+def verifyCacheEviction(treegen):
+	''' fill a geometry cache past its limit and check the least recently touched tree is the one evicted
+
+	treegen		: the loaded generator module
+	return		: the list of failure messages
+	'''
+	import numpy as np
+	failures = []
+	turtle = {'starts': np.zeros((100, 3))}
+	with temporaryCache(treegen) as directory:
+	    treegen.storeGeometry('first', turtle)
+	    treegen.storeGeometry('second', turtle)
+	    entry = os.path.join(directory, 'first')
+	    size = sum(os.path.getsize(os.path.join(entry, fileName)) for fileName in os.listdir(entry))
+	    #second is written after first, then first is touched by a hit and so becomes the most recently used
+	    os.utime(os.path.join(directory, 'first'), (1000, 1000))
+	    os.utime(os.path.join(directory, 'second'), (2000, 2000))
+	    if treegen.loadGeometry('first') is None:
+	        failures.append("the first tree was not in the cache")
+	    treegen.storeGeometry('third', turtle, limit=2 * size)
+	    kept = sorted(name for name in os.listdir(directory) if not name.startswith('.'))
+	    if kept != ['first', 'third']:
+	        failures.append("the cache kept %s rather than first and third" % ', '.join(kept))
+	return failures
+
+def verifyCacheTruncated(treegen):
+	''' cut a geometry cache entry short, as a crash while writing it would, and check it is a miss that the next store replaces
+
+	treegen		: the loaded generator module
+	return		: the list of failure messages
+	'''
+	import numpy as np
+	failures = []
+	turtle = {'starts': np.arange(300.0).reshape(100, 3)}
+	with temporaryCache(treegen) as directory:
+	    treegen.storeGeometry('tree', turtle)
+	    path = os.path.join(directory, 'tree', 'turtle.starts.npy')
+	    with open(path, 'r+b') as arrayFile:
+	        arrayFile.truncate(os.path.getsize(path) // 2)
+	    if treegen.loadGeometry('tree') is not None:
+	        failures.append("a truncated entry was a hit")
+	    treegen.storeGeometry('tree', turtle)
+	    geometry = treegen.loadGeometry('tree')
+	    if geometry is None or not sameArrays(geometry['turtle'], turtle):
+	        failures.append("storing the tree again did not replace the truncated entry")
+	return failures
+
+#the headless checks run by --verify, each takes the generator module and returns a list of failure messages
+VERIFY_CHECKS = (verifyTurtle, verifyUndoAfterCancel, verifyCancelledLeaves, verifyUndoDuringSlicedBuild, verifyHistorySnapshots, verifyMaterialMembers,
+                 verifyCacheHit, verifyCacheEviction, verifyCacheTruncated)
+
+def runVerify(treegen):
+	''' run every check in VERIFY_CHECKS headless, with a fresh undo history and without the geometry cache,
+	the cache checks turn it on in a temporary directory of their own
+
+	treegen		: the loaded generator module
+	return		: the number of failed checks
+	'''
+	previousBackend = treegen.setCommandBackend(treegen.RecordingCmds())
+	geometryCache = treegen.GEOMETRY_CACHE
+	treegen.GEOMETRY_CACHE = False
+	sliceSettings = treegen.SLICE_TIME, treegen.SLICE_CHUNK_SIZE
+	#short slices of small chunks, so a sliced build stepped by hand is still growing after its first step
+	treegen.SLICE_TIME, treegen.SLICE_CHUNK_SIZE = 1, 16
+	failed = 0
+	try:
+	    for check in VERIFY_CHECKS:
+	        treegen.lastBuild.clear()
+	        del treegen.undoStack[:]
+	        del treegen.redoStack[:]
+	        try:
+	            failures = check(treegen)
+	        except Exception as error:
+	            failures = ["raised %s: %s" % (type(error).__name__, error)]
+	        print("%-4s %s" % ('FAIL' if failures else 'ok', check.__name__))
+	        for failure in failures:
+	            print("     %s" % failure)
+	        failed += bool(failures)
+	finally:
+	    treegen.setCommandBackend(previousBackend)
+	    treegen.GEOMETRY_CACHE = geometryCache
+	    treegen.SLICE_TIME, treegen.SLICE_CHUNK_SIZE = sliceSettings
+	return failed
+
+def compareBaseline(results, baseline, tolerance):
+	''' compare the phase times of a run against a baseline run, printing the phases that got slower
+
+	results		: the results of runBenchmark
+	baseline	: the results of an earlier runBenchmark, as saved with --save-baseline
+	tolerance	: the ratio of the new to the baseline time above which a phase counts as a regression
+	return		: the list of (tree, phase, ratio) regressions
+	'''
+	regressions = []
+	newTime = oldTime = 0.0
+	for key, result in results.items():
+	    if key not in baseline:
+	        continue
+	    for phase in PHASES:
+	        old = baseline[key]['seconds'][phase]
+	        new = result['seconds'][phase]
+	        newTime += new
+	        oldTime += old
+	        #very short phases are all noise, so they are not compared on their own
+	        if old > 0.001 and new / old > tolerance:
+	            regressions.append((key, phase, new / old))
+
+	if oldTime:
+	    print("Total time %.3fs against %.3fs in the baseline, %.2fx" % (newTime, oldTime, newTime / oldTime))
+	for key, phase, ratio in regressions:
+	    print("REGRESSION %-24s %-10s %.2fx slower" % (key, phase, ratio))
+	return regressions
+
+def main(argv=None):
+	''' run the benchmark from the command line
+
+	argv		: the command line arguments, sys.argv when None
+	return		: the exit status, 1 when there are regressions against the baseline
+	'''
+	parser = argparse.ArgumentParser(description="Benchmark the L-System tree generator headless")
+	parser.add_argument('--iterations', type=int, nargs=2, default=(1, 7), metavar=('FIRST', 'LAST'), help="the range of iterations, both included")
+	parser.add_argument('--repeat', type=int, default=3, help="the number of runs of each phase, the fastest is kept")
+	parser.add_argument('--baseline', help="a baseline JSON file to compare against")
+	parser.add_argument('--tolerance', type=float, default=1.25, help="the slowdown against the baseline counted as a regression")
+	parser.add_argument('--save-baseline', dest='saveBaseline', help="write the results to this JSON file")
+	parser.add_argument('--generator', default=GENERATOR_PATH, help="the path of the generator file")
+	parser.add_argument('--verify', action='store_true', help="run the headless checks instead of the benchmark")
+	args = parser.parse_args(argv)
+
+	treegen = loadGenerator(args.generator)
+	if args.verify:
+	    return 1 if runVerify(treegen) else 0
+	results = runBenchmark(treegen, args.iterations, args.repeat)
+
+	if args.saveBaseline:
+	    with open(args.saveBaseline, 'w') as baselineFile:
+	        json.dump(results, baselineFile, indent=1, sort_keys=True)
+	if args.baseline:
+	    with open(args.baseline) as baselineFile:
+	        if compareBaseline(results, json.load(baselineFile), args.tolerance):
+	            return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())